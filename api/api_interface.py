@@ -1,5 +1,33 @@
-from requests import get, exceptions
+from requests import Session, exceptions
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import threading
 import time
+from util.codec import json_loads
+from util.config import read_config
+from util.metrics import metrics
+
+
+class TokenBucket():
+	def __init__(self, rate, capacity=None):
+		# Allow up to `capacity` requests in a burst, refilling at `rate` per second
+		self.rate = rate
+		self.capacity = capacity if capacity else max(1, rate)
+		self.tokens = self.capacity
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	def take(self):
+		while True:
+			with self.lock:
+				now = time.monotonic()
+				self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+				wait = (1 - self.tokens) / self.rate
+			time.sleep(wait)
 
 
 class Query():
@@ -8,50 +36,77 @@ class Query():
 	             url=None,
 	             allow_redirects=True,
 	             timeout=5,
-	             attempts=3,
-	             sleep=0.1,
 	             quiet=False):
 		self.response = None
 
-		for attempt in range(attempts):
-			if not self.response:
-				try:
-					if not quiet:
-						print("Requesting {}".format(url))
-					if method == "GET":
-						self.response = get(url, timeout=timeout, allow_redirects=allow_redirects)
-				except exceptions.Timeout:
-					if not quiet:
-						print("{} timed out".format(url))
-					time.sleep(sleep)
-				except exceptions.ConnectionError:
-					if not quiet:
-						print("Disconnected trying to get {}".format(url))
-					time.sleep(sleep)
-				except exceptions.HTTPError:
-					if not quiet:
-						print("Error {e} trying to get {u}".format(e=self.response.status_code, u=url))
-					time.sleep(sleep)
+		# Retries and backoff are handled by the session's adapter
+		try:
+			if not quiet:
+				print("Requesting {}".format(url))
+			if method == "GET":
+				self.response = get_session().get(url, timeout=timeout, allow_redirects=allow_redirects)
+		except exceptions.Timeout:
+			if not quiet:
+				print("{} timed out".format(url))
+		except exceptions.ConnectionError:
+			if not quiet:
+				print("Disconnected trying to get {}".format(url))
+		except exceptions.RetryError:
+			if not quiet:
+				print("Ran out of retries trying to get {}".format(url))
+
+		metrics.count("http_requests")
+		if self.response is not None:
+			metrics.count("http_bytes", len(self.response.content))
+			retries = getattr(self.response.raw, "retries", None)
+			if retries:
+				metrics.count("http_retries", len(retries.history))
 
 		if not self.response:
+			metrics.count("http_failures")
 			print("Query {m} {u} failed".format(m=method, u=url))
 
 
+def get_session():
+	# One pooled session shared by every request and thread, so connections to the API are kept alive.
+	# Retries and backoff come from the config, where 0 turns them off
+	global session
+	with session_lock:
+		if not session:
+			pool_size = read_config("http_pool_size") or 10
+			retries = read_config("http_retries")
+			backoff = read_config("http_backoff")
+			retry = Retry(total=3 if retries is None else retries,
+			              backoff_factor=0.5 if backoff is None else backoff,
+			              status_forcelist=[429, 500, 502, 503, 504],
+			              allowed_methods=["GET"],
+			              respect_retry_after_header=True,
+			              raise_on_status=False)
+			adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+			session = Session()
+			session.mount("https://", adapter)
+			session.mount("http://", adapter)
+
+	return session
+
+
+session = None
+session_lock = threading.Lock()
+
+
 class Request():
 	def __init__(self, **kwargs):
 		# Functional settings
 		self.quiet = kwargs.get("quiet")
-		self.sleep = kwargs.get("sleep")
 		self.purpose = kwargs.get("purpose")
 
 		# Header settings
 		self.method = kwargs.get("method")
 		self.allow_redirects = kwargs.get("allow_redirects")
 		self.timeout = kwargs.get("timeout")
-		self.attempts = kwargs.get("attempts")
 
 		# Query elements
-		self.base_url = "https://api.gbif.org/v1"
+		self.base_url = read_config("api_base_url") or "https://api.gbif.org/v1"
 		self.api = kwargs.get("api")
 		self.endpoint = kwargs.get("endpoint")
 		self.dataset_id = kwargs.get("dataset_id")
@@ -106,8 +161,6 @@ class Request():
 				              url=self.request_url,
 				              allow_redirects=self.allow_redirects,
 				              timeout=self.timeout,
-				              attempts=self.attempts,
-				              sleep=self.sleep,
 				              quiet=self.quiet).response
 
 		if self.response:
@@ -130,11 +183,11 @@ class Request():
 				self.save_records()
 
 	def save_records(self):
-		response_json = self.response.json()
+		response_json = json_loads(self.response.content)
 		if not self.record_count:
 			self.record_count = response_json["count"]
 		if response_json.get("results"):
 			self.records.extend([i for i in response_json["results"]])
 
 	def save_response(self):
-		self.response_data = self.response.json()
+		self.response_data = json_loads(self.response.content)
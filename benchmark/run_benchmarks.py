@@ -0,0 +1,176 @@
+import os
+import io
+import sys
+import json
+import yaml
+import time
+import shutil
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@contextmanager
+def timed(timings, stage):
+	start = time.perf_counter()
+	yield
+	timings[stage] = round(time.perf_counter() - start, 4)
+
+
+def prepare_workdir(workdir):
+	for directory in ["data/saved_data", "data/report_data", "report/report_outputs"]:
+		os.makedirs(os.path.join(workdir, directory), exist_ok=True)
+	shutil.copytree(os.path.join(repo_root, "templates"), os.path.join(workdir, "templates"), dirs_exist_ok=True)
+
+
+def run_scale(download_count, month_count, workdir, process_workers=1):
+	# Runs every stage once against synthetic data, in a fresh process per scale so global state starts empty
+	from benchmark.synthetic import generate_activity, generate_report_inputs
+	from benchmark.stub_api import start_stub_api
+	from util import config
+
+	prepare_workdir(workdir)
+	os.chdir(workdir)
+	server, api_base_url = start_stub_api()
+	config.config = {"api_base_url": api_base_url,
+	                 "report_mode": "full",
+	                 "limit": 20,
+	                 "taxon_workers": 8,
+	                 "process_workers": process_workers}
+
+	from data.io_interface import list_activity_files, iter_json_file, open_text_file
+	from util import codec
+	from util.processing import process_activity_data, find_greatest_proportion, resolve_taxa, clear_loaded_data
+	from util.export import export_report_data
+	from report import report
+	from util.metrics import metrics
+
+	timings = {}
+	with timed(timings, "generate"):
+		month_counts = generate_activity("data/saved_data", download_count, month_count)
+		generate_report_inputs(".", month_counts)
+
+	with timed(timings, "load"):
+		loaded = sum(1 for filepath in list_activity_files("data/saved_data") for _ in iter_json_file(filepath))
+
+	# The same full history parsed with the stdlib and with the codec layer, to show what the C backends save
+	with timed(timings, "json_parse_stdlib"):
+		for filepath in list_activity_files("data/saved_data"):
+			with open_text_file(filepath) as f:
+				for line in f:
+					json.loads(line)
+
+	with timed(timings, "json_parse_codec"):
+		for filepath in list_activity_files("data/saved_data"):
+			with open_text_file(filepath) as f:
+				for line in f:
+					codec.json_loads(line)
+
+	with timed(timings, "aggregate"):
+		process_activity_data()
+
+	with timed(timings, "aggregate_cached"):
+		clear_loaded_data()
+		process_activity_data()
+
+	with timed(timings, "rank"):
+		find_greatest_proportion()
+		resolve_taxa()
+
+	with timed(timings, "export"):
+		export_report_data()
+
+	with open("data/report_data/report_data.yaml", "r", encoding="utf-8") as f:
+		report_data = codec.yaml_load(f)
+
+	with timed(timings, "yaml_roundtrip_pure"):
+		for _ in range(20):
+			yaml.load(yaml.dump(report_data, Dumper=yaml.SafeDumper), Loader=yaml.SafeLoader)
+
+	with timed(timings, "yaml_roundtrip_codec"):
+		for _ in range(20):
+			buffer = io.StringIO()
+			codec.yaml_dump(report_data, buffer)
+			buffer.seek(0)
+			codec.yaml_load(buffer)
+
+	with timed(timings, "render"):
+		analytics_data, export_counts, total_records_count = report.load_analytics_data()
+		blocks = report.build_report_blocks(analytics_data, export_counts, total_records_count)
+		report.combine_blocks(*blocks)
+
+	with timed(timings, "render_cached"):
+		analytics_data, export_counts, total_records_count = report.load_analytics_data()
+		blocks = report.build_report_blocks(analytics_data, export_counts, total_records_count)
+		report.combine_blocks(*blocks)
+
+	server.shutdown()
+	return {"downloads": loaded,
+	        "months": month_count,
+	        "timings": timings,
+	        "records_per_second": round(loaded / timings["aggregate"], 1) if timings["aggregate"] else None,
+	        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+	        "counters": metrics.counters,
+	        "codec": {"orjson": codec.orjson is not None,
+	                  "libyaml": codec.SafeLoader.__name__ == "CSafeLoader"}}
+
+
+def git_revision():
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo_root, capture_output=True,
+		                      text=True).stdout.strip()
+	except OSError:
+		return None
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Time each analytics stage against synthetic GBIF activity")
+	parser.add_argument("--scales", type=int, nargs="+", default=[10000, 100000, 1000000])
+	parser.add_argument("--months", type=int, default=12)
+	parser.add_argument("--process-workers", type=int, default=1)
+	parser.add_argument("--output", default=os.path.join(repo_root, "benchmark", "results"))
+	parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+	parser.add_argument("--result-file", help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.single:
+		with tempfile.TemporaryDirectory() as workdir:
+			result = run_scale(args.single, args.months, workdir, args.process_workers)
+		with open(args.result_file, "w", encoding="utf-8") as f:
+			json.dump(result, f)
+		return
+
+	results = {"revision": git_revision(),
+	           "process_workers": args.process_workers,
+	           "python": platform.python_version(),
+	           "started": datetime.now().isoformat(timespec="seconds"),
+	           "scales": []}
+	for scale in args.scales:
+		print("Benchmarking {} downloads".format(scale))
+		with tempfile.NamedTemporaryFile(suffix=".json") as result_file:
+			subprocess.run([sys.executable, "-m", "benchmark.run_benchmarks",
+			                "--single", str(scale),
+			                "--months", str(args.months),
+			                "--process-workers", str(args.process_workers),
+			                "--result-file", result_file.name],
+			               cwd=repo_root, check=True, stdout=subprocess.DEVNULL)
+			with open(result_file.name, "r", encoding="utf-8") as f:
+				result = json.load(f)
+		print(json.dumps(result["timings"]))
+		results["scales"].append(result)
+
+	os.makedirs(args.output, exist_ok=True)
+	output_file = os.path.join(args.output, "{}.json".format(datetime.now().strftime("%Y%m%d-%H%M%S")))
+	with open(output_file, "w", encoding="utf-8") as f:
+		json.dump(results, f, indent=2)
+	print("Saved results to {}".format(output_file))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,46 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubGbifHandler(BaseHTTPRequestHandler):
+	# Answers the species and literature lookups the report makes, so benchmarks run offline
+	protocol_version = "HTTP/1.1"
+	disable_nagle_algorithm = True
+
+	def do_GET(self):
+		path = self.path.split("?")[0]
+		species_match = re.match(r"^/v1/species/([^/]+)/name$", path)
+		if species_match:
+			usage_key = species_match.group(1)
+			self.send_json({"key": usage_key,
+			                "scientificName": "Synthetic taxon {}".format(usage_key),
+			                "rank": "SPECIES"})
+		elif path == "/v1/literature/search":
+			self.send_json({"count": 1,
+			                "results": [{"title": "Synthetic paper",
+			                             "authors": [{"firstName": "A", "lastName": "Author"}],
+			                             "year": 2024,
+			                             "source": "Journal",
+			                             "websites": ["https://example.org"]}]})
+		else:
+			self.send_json({"error": "not found"}, status=404)
+
+	def send_json(self, content, status=200):
+		body = json.dumps(content).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+def start_stub_api():
+	server = ThreadingHTTPServer(("127.0.0.1", 0), StubGbifHandler)
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	return server, "http://127.0.0.1:{}/v1".format(server.server_address[1])
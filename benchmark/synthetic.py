@@ -0,0 +1,114 @@
+import os
+import csv
+import random
+from datetime import date, datetime, timedelta
+from data.io_interface import write_json_file, get_activity_storage
+from util.codec import yaml_dump
+
+continents = ["OCEANIA", "ASIA", "EUROPE", "AFRICA", "NORTH_AMERICA", "SOUTH_AMERICA", "ANTARCTICA"]
+countries = ["NZ", "AU", "NC", "FJ", "US", "GB", "AQ", "JP", "ZA", "CL"]
+states = ["Wellington", "Canterbury", "Otago", "Auckland", "Southland", "Tasmania", "Queensland"]
+localities = ["Kapiti Island", "Chatham Islands", "Campbell Island", "Stewart Island", "Fiordland"]
+basis_of_record = ["PRESERVED_SPECIMEN", "HUMAN_OBSERVATION", "MATERIAL_SAMPLE", "FOSSIL_SPECIMEN"]
+
+
+def make_event(index, created, rng, taxon_pool=5000):
+	# Roughly the shape of a GBIF download event, with a nested predicate tree
+	predicates = [{"type": "equals", "key": "HAS_GEOSPATIAL_ISSUE", "value": "false"},
+	              {"type": "equals", "key": "OCCURRENCE_STATUS", "value": "present"}]
+	if rng.random() < 0.7:
+		taxon_keys = [str(rng.randint(1, taxon_pool)) for _ in range(rng.randint(1, 6))]
+		if len(taxon_keys) == 1:
+			predicates.append({"type": "equals", "key": "TAXON_KEY", "value": taxon_keys[0]})
+		else:
+			predicates.append({"type": "in", "key": "TAXON_KEY", "values": taxon_keys})
+	if rng.random() < 0.5:
+		predicates.append({"type": "or",
+		                   "predicates": [{"type": "equals", "key": "COUNTRY", "value": rng.choice(countries)},
+		                                  {"type": "equals", "key": "CONTINENT", "value": rng.choice(continents)}]})
+	if rng.random() < 0.2:
+		predicates.append({"type": "and",
+		                   "predicates": [{"type": "in", "key": "STATE_PROVINCE",
+		                                   "values": rng.sample(states, rng.randint(1, 3))},
+		                                  {"type": "equals", "key": "LOCALITY", "value": rng.choice(localities)}]})
+	if rng.random() < 0.3:
+		predicates.append({"type": "in", "key": "BASIS_OF_RECORD",
+		                   "values": rng.sample(basis_of_record, rng.randint(1, 2))})
+	if rng.random() < 0.3:
+		predicates.append({"type": "greaterThanOrEquals", "key": "YEAR", "value": str(rng.randint(1850, 2020))})
+
+	total_records = rng.randint(1, 5000000)
+	number_records = rng.randint(1, min(total_records, 300000))
+	return {"downloadKey": "{d}-{i:09d}".format(d=created.strftime("%Y%m%d"), i=index),
+	        "datasetKey": "synthetic-dataset",
+	        "numberRecords": number_records,
+	        "download": {"key": "{d}-{i:09d}".format(d=created.strftime("%Y%m%d"), i=index),
+	                     "doi": "10.15468/dl.{:06x}".format(index),
+	                     "created": created.strftime("%Y-%m-%dT%H:%M:%S.000+00:00"),
+	                     "modified": created.strftime("%Y-%m-%dT%H:%M:%S.000+00:00"),
+	                     "status": "SUCCEEDED",
+	                     "totalRecords": total_records,
+	                     "numberDatasets": rng.randint(1, 2000),
+	                     "request": {"type": rng.choice(["DWCA", "SIMPLE_CSV", "SPECIES_LIST"]),
+	                                 "format": "DWCA",
+	                                 "creator": "user{}".format(rng.randint(1, 20000)),
+	                                 "predicate": {"type": "and", "predicates": predicates}}}}
+
+
+def list_months(month_count):
+	# The most recent complete months, newest first
+	today = date.today()
+	year, month = today.year, today.month
+	months = []
+	for _ in range(month_count):
+		month -= 1
+		if month == 0:
+			year, month = year - 1, 12
+		months.append((year, month))
+	return months
+
+
+def generate_activity(directory, download_count, month_count=12, seed=1):
+	rng = random.Random(seed)
+	months = list_months(month_count)
+	per_month = max(1, download_count // month_count)
+	index = 0
+	month_counts = {}
+	for year, month in months:
+		start = datetime(year, month, 1)
+		events = []
+		for _ in range(per_month):
+			created = start + timedelta(seconds=rng.randint(0, 27 * 86400))
+			events.append(make_event(index, created, rng))
+			index += 1
+		events.sort(key=lambda event: event["download"]["created"], reverse=True)
+		storage = get_activity_storage()
+		storage.write(storage.filepath("{y}{m:02d}".format(y=year, m=month), directory), events)
+		month_counts[(year, month)] = len(events)
+
+	write_json_file("{}/saved_metadata.json".format(directory), {"total_count": index})
+	return month_counts
+
+
+def generate_report_inputs(workdir, month_counts):
+	citations = {"count": 3,
+	             "publications": [{"reference": "Author A, Synthetic paper {}, (2024) Journal".format(i),
+	                               "link": "https://example.org/{}".format(i)} for i in range(3)]}
+	write_json_file("{}/data/saved_data/citations.json".format(workdir), citations)
+
+	with open("{}/data/saved_data/downloads_statistics.tsv".format(workdir), "w", newline="", encoding="utf-8") as f:
+		writer = csv.writer(f, delimiter="\t")
+		writer.writerow(["year", "month", "number_downloads"])
+		for (year, month), count in month_counts.items():
+			writer.writerow([year, month, count])
+
+	os.makedirs("{}/data/export_counts".format(workdir), exist_ok=True)
+	for year, month in sorted(month_counts.keys()):
+		export_count = {"year": year,
+		                "month": month,
+		                "records_written": {"core": 1000000 + month, "multimedia": 200000 + month},
+		                "new_record_counts": {"object": 100, "agent": 10, "taxon": 5},
+		                "update_counts": {"object": 50, "agent": 5, "taxon": 2}}
+		with open("{w}/data/export_counts/{y}{m:02d}.yaml".format(w=workdir, y=year, m=month), "w",
+		          encoding="utf-8") as f:
+			yaml_dump(export_count, f)
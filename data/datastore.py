@@ -1,4 +1,10 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
 from api.api_interface import Request
+from data.io_interface import read_record_at
+from data.taxon_cache import TaxonCache
+from util.config import read_config
 
 
 class ActivityData():
@@ -6,24 +12,58 @@ class ActivityData():
 		self.data = []
 		self.full_count = 0
 		self.month_count = 0
+		# Top-k rankings already worked out, by k, along with how many records they were ranked from
+		self.rankings = {}
 
 
 class ActivityRecord():
-	def __init__(self, activity_key, data):
-		self.activity_key = activity_key
+	__slots__ = ("activity_key", "source", "position", "created", "include_in_report", "taxon_keys", "locations",
+	             "doi", "request_type", "total_records", "te_papa_records", "contribution_percentage",
+	             "main_predicates", "flattened")
+
+	def __init__(self, activity_key, source=None, position=None):
+		self.activity_key = intern_value(activity_key)
+		# Where the full download JSON can be reread from, rather than keeping it in memory
+		self.source = intern_value(source)
+		self.position = position
+		self.created = None
 		self.include_in_report = True
 		self.taxon_keys = []
 		self.locations = []
-		self.data = data
 		self.doi = None
+		self.request_type = None
 		self.total_records = None
 		self.te_papa_records = None
 		self.contribution_percentage = None
-		self.main_predicates = {"taxa": None,
-		                        "locations": None}
-		self.link = None
+		self.main_predicates = None
 		self.flattened = False
-		self.exclude_from_sort = False
+
+	@property
+	def link(self):
+		return "https://www.gbif.org/occurrence/download/{}".format(self.activity_key)
+
+	@property
+	def data(self):
+		if self.source is None:
+			return None
+		return read_record_at(self.source, self.position)
+
+	def to_dict(self):
+		return {"activity_key": self.activity_key,
+		        "doi": self.doi,
+		        "request_type": self.request_type,
+		        "total_records": self.total_records,
+		        "te_papa_records": self.te_papa_records,
+		        "contribution_percentage": self.contribution_percentage,
+		        "main_predicates": self.main_predicates,
+		        "link": self.link}
+
+
+def intern_value(value):
+	# Keys and predicate values repeat across many downloads, so share one copy of each string
+	if isinstance(value, str):
+		return sys.intern(value)
+	return value
 
 
 class TaxonRecord():
@@ -35,12 +75,10 @@ class TaxonRecord():
 	def query_api_for_taxon(self):
 		if not self.data:
 			request_kwargs = {"quiet": True,
-			                  "sleep": 0.1,
 			                  "purpose": "species_lookup",
 			                  "method": "GET",
 			                  "allow_redirects": True,
 			                  "timeout": 5,
-			                  "attempts": 3,
 			                  "api": "species",
 			                  "endpoint": "name",
 			                  "usage_key": self.taxon_key}
@@ -55,13 +93,32 @@ class TaxonRecord():
 class TaxonData():
 	def __init__(self):
 		self.data = {}
+		self.cache = TaxonCache()
 
 	def retrieve_taxon_details(self, taxon_keys):
 		for taxon_key in taxon_keys:
 			taxon_details = self.data.get(taxon_key)
 			if not taxon_details:
-				self.data[taxon_key] = TaxonRecord(taxon_key)
-				self.data[taxon_key].query_api_for_taxon()
+				self.data[taxon_key] = self.lookup_taxon(taxon_key)
+
+	def resolve_taxon_details(self, taxon_keys):
+		# Look up every missing taxon in one pass, spread over a pool of workers
+		missing_keys = [taxon_key for taxon_key in set(taxon_keys) if not self.data.get(taxon_key)]
+		if not missing_keys:
+			return
+		with ThreadPoolExecutor(max_workers=read_config("taxon_workers") or 8) as executor:
+			taxon_records = executor.map(self.lookup_taxon, missing_keys)
+			for taxon_record in tqdm(taxon_records, total=len(missing_keys), desc="Resolving taxa"):
+				self.data[taxon_record.taxon_key] = taxon_record
+
+	def lookup_taxon(self, taxon_key):
+		taxon_record = TaxonRecord(taxon_key)
+		taxon_record.data = self.cache.get(taxon_key)
+		if not taxon_record.data:
+			if taxon_record.query_api_for_taxon():
+				self.cache.put(taxon_key, taxon_record.data)
+
+		return taxon_record
 
 
 class Location():
@@ -102,6 +159,8 @@ activity_memo = {}
 activity_data = ActivityData()
 location_memo = {}
 locations = {}
+predicate_memo = {}
+tracked_predicates = {}
 taxon_keys = []
 taxon_memo = {}
 taxon_data = TaxonData()
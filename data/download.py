@@ -1,33 +1,38 @@
+import os
 from math import ceil
-from datetime import datetime, date
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 from tqdm import tqdm
-import time
-from api.api_interface import Request
-from data.io_interface import write_json_file
+from api.api_interface import Request, TokenBucket
+from data.io_interface import (write_json_file, read_json_file, replace_json_file, get_activity_storage,
+                               remove_activity_files)
 from data.datastore import metadata_memo
 from util.config import read_config
+from util.metrics import metrics
 
+checkpoint_file = "data/saved_data/download_checkpoint.json"
 
-def download_activity(dataset_id, download_mode):
+
+def download_activity(dataset_id, download_mode, on_month_complete=None):
+	# on_month_complete is called with each month file's path once all of that month has been downloaded
 	if download_mode:
 		if download_mode == "full":
-			request_activity(dataset_id)
+			request_activity(dataset_id, on_month_complete=on_month_complete)
 		else:
-			request_activity(dataset_id, since=download_mode)
+			request_activity(dataset_id, since=download_mode, on_month_complete=on_month_complete)
 	else:
 		request_activity(dataset_id, count_only=True)
 
 	write_json_file("data/saved_data/saved_metadata.json", metadata_memo)
 
 
-def request_activity(dataset_id, since=None, count_only=False):
+def request_activity(dataset_id, since=None, count_only=False, on_month_complete=None):
 	request_kwargs = {"quiet": True,
-	                  "sleep": 0.1,
 	                  "purpose": "dataset_activity",
 	                  "method": "GET",
 	                  "allow_redirects": True,
 	                  "timeout": 5,
-	                  "attempts": 3,
 	                  "api": "occurrence",
 	                  "endpoint": None,
 	                  "dataset_id": dataset_id}
@@ -38,8 +43,7 @@ def request_activity(dataset_id, since=None, count_only=False):
 		return activity_count
 
 	if activity_count:
-		page_count = ceil(activity_count / read_config("limit"))
-		get_activity_pages(page_count, request_kwargs, since)
+		get_activity_pages(activity_count, request_kwargs, since, on_month_complete)
 
 
 def get_activity_count(kwargs):
@@ -50,39 +54,173 @@ def get_activity_count(kwargs):
 	return activity_count_request.record_count
 
 
-def get_activity_pages(page_count, request_kwargs, since):
+def get_activity_pages(activity_count, request_kwargs, since, on_month_complete=None):
 	since_datestamp = None
 	if since:
 		year = since[:4]
 		month = since[-2:]
 		since_datestamp = date(int(year), int(month), 1)
-	activity = []
-	for i in tqdm(range(page_count), desc="Getting activity details"):
-#	for i in tqdm(range(30), desc="Getting activity details"):
-		page_results = get_activity_page(i, request_kwargs)
-		activity.extend(page_results)
-		if since:
-			if not check_activity_dates(page_results, since_datestamp):
-				break
-		time.sleep(1)
-
-	dump_activity_by_month(activity, since_datestamp)
-
-
-def check_activity_dates(page_results, since_datestamp):
-	for activity in page_results:
-		activity_date = activity["download"]["created"].split("T")[0]
-		activity_datestamp = date.fromisoformat(activity_date)
-		if activity_datestamp >= since_datestamp:
-			continue
-		else:
-			return False
-	return True
 
+	# Pages go straight into their month's file as they arrive, and a checkpoint lets an
+	# interrupted download carry on where it stopped
+	dataset_id = request_kwargs["dataset_id"]
+	limit = read_config("limit")
+	checkpoint = resume_from_checkpoint(dataset_id, since, activity_count)
+	start_offset = checkpoint.get("next_offset", 0)
+	partitioner = MonthPartitioner(since_datestamp, checkpoint.get("month"), checkpoint.get("month_size"),
+	                               on_month_complete)
+	page_count = max(0, ceil((activity_count - start_offset) / limit))
+	complete = True
+	pages = fetch_activity_pages(page_count, request_kwargs, start_offset)
+	for offset, page_results in tqdm(pages, total=page_count, desc="Getting activity details"):
+		if page_results is None:
+			print("Failed to get activity from offset {}, rerun to resume from there".format(offset))
+			complete = False
+			break
+		metrics.count("activity_records_downloaded", len(page_results))
+		in_range = partitioner.add(page_results)
+		save_checkpoint(dataset_id, since, activity_count, offset + limit, partitioner.month, partitioner.size())
+		if not in_range:
+			break
+	pages.close()
+
+	if complete:
+		partitioner.finish_month()
+		clear_checkpoint()
+	else:
+		partitioner.close()
+
+
+class MonthPartitioner():
+	def __init__(self, since_datestamp=None, month=None, month_size=None, on_month_complete=None):
+		self.since_datestamp = since_datestamp
+		self.on_month_complete = on_month_complete
+		self.storage = get_activity_storage()
+		self.month = None
+		self.filepath = None
+		self.partial_filepath = None
+		if month:
+			self.open_month(month, resume_size=month_size)
+
+	def add(self, events):
+		# Activity comes newest first, so a month is complete as soon as an older one turns up
+		batch = []
+		for event in events:
+			activity_date = event["download"]["created"].split("T")[0]
+			if self.since_datestamp:
+				if date.fromisoformat(activity_date) < self.since_datestamp:
+					self.write(batch)
+					self.finish_month()
+					return False
+			month = activity_date[:4] + activity_date[5:7]
+			if month != self.month:
+				self.write(batch)
+				batch = []
+				self.finish_month()
+				self.open_month(month)
+			batch.append(event)
+		self.write(batch)
+		return True
+
+	def write(self, batch):
+		if batch:
+			self.storage.append(self.partial_filepath, batch)
+
+	def open_month(self, month, resume_size=None):
+		# A month is written to a .partial file and only replaces the saved month once it is complete,
+		# so a download that stops partway never leaves a month with fewer records than before
+		self.close()
+		self.filepath = self.storage.filepath(month)
+		self.partial_filepath = self.filepath + ".partial"
+		if resume_size is None:
+			if os.path.exists(self.partial_filepath):
+				os.remove(self.partial_filepath)
+		elif os.path.exists(self.partial_filepath):
+			# Drop anything written after the last checkpoint, since that page will be fetched again
+			os.truncate(self.partial_filepath, resume_size)
+		self.month = month
+
+	def size(self):
+		if self.partial_filepath and os.path.exists(self.partial_filepath):
+			return os.path.getsize(self.partial_filepath)
+		return 0
+
+	def finish_month(self):
+		if self.filepath:
+			if os.path.exists(self.partial_filepath):
+				remove_activity_files(self.month)
+				os.replace(self.partial_filepath, self.filepath)
+			if self.on_month_complete:
+				self.on_month_complete(self.filepath)
+		self.close()
+
+	def close(self):
+		self.month = None
+		self.filepath = None
+		self.partial_filepath = None
+
+
+def resume_from_checkpoint(dataset_id, since, activity_count):
+	checkpoint = None
+	if os.path.exists(checkpoint_file):
+		checkpoint = read_json_file(checkpoint_file)
+	if not checkpoint or checkpoint.get("dataset_id") != dataset_id or checkpoint.get("since") != since:
+		if checkpoint and checkpoint.get("month"):
+			# The saved month file was never touched, so only the unfinished copy goes
+			partial_filepath = get_activity_storage().filepath(checkpoint["month"]) + ".partial"
+			if os.path.exists(partial_filepath):
+				os.remove(partial_filepath)
+		clear_checkpoint()
+		return {}
+
+	# Activity is listed newest first, so downloads made since the checkpoint push everything along
+	checkpoint["next_offset"] += max(0, activity_count - checkpoint["total_count"])
+	print("Resuming activity download from offset {}".format(checkpoint["next_offset"]))
+	return checkpoint
 
-def get_activity_page(i, kwargs):
+
+def save_checkpoint(dataset_id, since, activity_count, next_offset, month, month_size):
+	replace_json_file(checkpoint_file, {"dataset_id": dataset_id,
+	                                    "since": since,
+	                                    "total_count": activity_count,
+	                                    "next_offset": next_offset,
+	                                    "month": month,
+	                                    "month_size": month_size})
+
+
+def clear_checkpoint():
+	try:
+		os.remove(checkpoint_file)
+	except FileNotFoundError:
+		pass
+
+
+def fetch_activity_pages(page_count, request_kwargs, start_offset=0):
+	# Keeps up to max_requests_in_flight pages requesting at once, but yields them in offset order
+	limit = read_config("limit")
+	max_in_flight = read_config("max_requests_in_flight") or 1
+	rate_limit = TokenBucket(read_config("requests_per_second") or 1, read_config("request_burst"))
+	pending = deque()
+	next_page = 0
+	with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+		try:
+			while pending or next_page < page_count:
+				while next_page < page_count and len(pending) < max_in_flight:
+					offset = start_offset + next_page * limit
+					pending.append((offset,
+					                executor.submit(get_activity_page, offset, dict(request_kwargs), rate_limit)))
+					next_page += 1
+				offset, future = pending.popleft()
+				yield offset, future.result()
+		finally:
+			for offset, future in pending:
+				future.cancel()
+
+
+def get_activity_page(offset, kwargs, rate_limit=None):
+	if rate_limit:
+		rate_limit.take()
 	limit = read_config("limit")
-	offset = i * limit
 	kwargs["limit"] = limit
 	kwargs["offset"] = offset
 	activity_page_request = Request(**kwargs)
@@ -94,50 +232,12 @@ def get_activity_page(i, kwargs):
 		return None
 
 
-def dump_activity_by_month(activity, since_datestamp=None):
-	now = datetime.now()
-	month = now.month
-	year = now.year
-	activity_batch = []
-	for act in activity:
-		activity_date = act["download"]["created"].split("T")[0]
-		activity_datestamp = date.fromisoformat(activity_date)
-		if activity_datestamp.month == month and activity_datestamp.year == year:
-			activity_batch.append(act)
-		else:
-			dump_month(month, year, activity_batch, since_datestamp)
-			if since_datestamp:
-				if activity_datestamp < since_datestamp:
-					break
-			month = activity_datestamp.month
-			year = activity_datestamp.year
-			activity_batch = [act]
-
-	if len(activity_batch) > 0:
-		dump_month(month, year, activity_batch, since_datestamp)
-
-
-def dump_month(month, year, activity_batch, since_datestamp):
-	if month < 10:
-		month_string = "0" + str(month)
-	else:
-		month_string = str(month)
-	filepath = "data/saved_data/{y}{m}-activity.json".format(y=str(year), m=month_string)
-	replace = False
-	if since_datestamp:
-		if since_datestamp <= date(year=year, month=month, day=1):
-			replace = True
-	write_json_file(filepath, activity_batch, replace=replace)
-
-
 def download_citations(dataset_id):
 	request_kwargs = {"quiet": True,
-	                  "sleep": 0.1,
 	                  "purpose": "citation_search",
 	                  "method": "GET",
 	                  "allow_redirects": True,
 	                  "timeout": 5,
-	                  "attempts": 3,
 	                  "api": "literature",
 	                  "endpoint": "search",
 	                  "dataset_id": dataset_id}
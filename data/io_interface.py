@@ -1,13 +1,27 @@
 import os
-import json
+import io
+import gzip
+from itertools import islice
+from util.codec import json_load, json_dump, json_loads, json_dumps, JSONDecodeError
+from util.config import read_config
+try:
+	import ijson
+except ImportError:
+	ijson = None
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+temp_suffixes = (".tmp", ".partial")
 
 
 def read_json_file(filepath):
 	try:
 		with open(filepath, "r", encoding="utf-8") as f:
-			data = json.load(f)
+			data = json_load(f)
 			return data
-	except json.decoder.JSONDecodeError:
+	except JSONDecodeError:
 		return None
 
 
@@ -19,19 +33,183 @@ def write_json_file(filepath, content, replace=False):
 			pass
 	try:
 		with open(filepath, "w+", encoding="utf-8") as f:
-			json.dump(content, f)
+			json_dump(content, f)
 	except IOError:
 		print("Failed to write {}".format(filepath))
 
 
-def read_directory_files(directory, dontload=None):
-	data = []
-	for file in os.listdir(directory):
-		if file == dontload:
-			pass
+def replace_json_file(filepath, content):
+	# Write to a temporary file first, so a crash never leaves a half-written file behind
+	temp_filepath = filepath + ".tmp"
+	with open(temp_filepath, "w", encoding="utf-8") as f:
+		json_dump(content, f)
+	os.replace(temp_filepath, filepath)
+
+
+def file_stat_fingerprint(filepath):
+	file_stats = os.stat(filepath)
+	return {"size": file_stats.st_size, "mtime": file_stats.st_mtime_ns}
+
+
+def update_file_index(index_file, filepaths, build_entry):
+	# Keeps what build_entry makes of each file in one JSON file, along with the fingerprint of the file it was
+	# made from, so a file is only read again once it changes. Files no longer listed are dropped
+	saved_index = {}
+	if os.path.exists(index_file):
+		saved_index = read_json_file(index_file) or {}
+
+	file_index = {}
+	for filepath in filepaths:
+		fingerprint = file_stat_fingerprint(filepath)
+		entry = saved_index.get(filepath)
+		if not isinstance(entry, dict) or entry.get("fingerprint") != fingerprint:
+			entry = build_entry(filepath)
+			entry["fingerprint"] = fingerprint
+		file_index[filepath] = entry
+
+	if file_index != saved_index:
+		replace_json_file(index_file, file_index)
+
+	return file_index
+
+
+def append_json_lines(f, records):
+	for record in records:
+		f.write(json_dumps(record))
+		f.write("\n")
+
+
+def open_text_file(filepath, mode="r"):
+	# Compressed JSON Lines files are opened by their suffix, ignoring any temporary file suffix after it
+	name = filepath
+	for temp_suffix in temp_suffixes:
+		if name.endswith(temp_suffix):
+			name = name[:-len(temp_suffix)]
+	if name.endswith(".gz"):
+		return gzip.open(filepath, mode + "t", encoding="utf-8")
+	elif name.endswith(".zst"):
+		if not zstandard:
+			raise ImportError("zstandard is needed to read and write {}".format(filepath))
+		if mode == "r":
+			raw = zstandard.ZstdDecompressor().stream_reader(open(filepath, "rb"), read_across_frames=True)
 		else:
-			file_data = read_json_file("{}/{}".format(directory, file))
-			if file_data:
-				data.extend(file_data)
+			raw = zstandard.ZstdCompressor().stream_writer(open(filepath, mode + "b"))
+		return io.TextIOWrapper(raw, encoding="utf-8")
+	return open(filepath, mode, encoding="utf-8")
+
+
+def iter_json_file(filepath):
+	# Yields one record at a time from a JSON Lines file, or from a JSON array if ijson is available
+	if not filepath.endswith(".json"):
+		with open_text_file(filepath, "r") as f:
+			for line in f:
+				if line.strip():
+					yield json_loads(line)
+	elif ijson:
+		with open(filepath, "rb") as f:
+			try:
+				yield from ijson.items(f, "item", use_float=True)
+			except ijson.JSONError:
+				print("Failed to parse {}".format(filepath))
+	else:
+		data = read_json_file(filepath)
+		if data:
+			yield from data
+
+
+def enumerate_json_file(filepath, keep_line=None):
+	# Yields (position, record) pairs, where keep_line can turn down a JSON Lines record before it is parsed.
+	# Positions still count every record, so read_record_at finds the same ones later
+	if filepath.endswith(".json") or not keep_line:
+		yield from enumerate(iter_json_file(filepath))
+		return
+
+	position = 0
+	with open_text_file(filepath, "r") as f:
+		for line in f:
+			if line.strip():
+				if keep_line(line):
+					yield position, json_loads(line)
+				position += 1
+
+
+def read_record_at(filepath, position):
+	return next(islice(iter_json_file(filepath), position, None), None)
+
+
+class JsonLinesStorage():
+	def __init__(self, compression=None):
+		self.compression = compression
+		self.suffix = "-activity.jsonl" + {None: "", "gzip": ".gz", "zstd": ".zst"}[compression]
 
-	return data
+	def filepath(self, month, directory="data/saved_data"):
+		return "{d}/{m}{s}".format(d=directory, m=month, s=self.suffix)
+
+	def append(self, filepath, records):
+		# Every append is closed off on its own, so a compressed file can be cut back to any earlier size
+		with open_text_file(filepath, "a") as f:
+			append_json_lines(f, records)
+
+	def write(self, filepath, records):
+		with open_text_file(filepath, "w") as f:
+			append_json_lines(f, records)
+
+
+storage_backends = {"jsonl": JsonLinesStorage(),
+                    "jsonl.gz": JsonLinesStorage("gzip"),
+                    "jsonl.zst": JsonLinesStorage("zstd")}
+activity_suffixes = ("-activity.json", "-activity.jsonl", "-activity.jsonl.gz", "-activity.jsonl.zst")
+
+
+def get_activity_storage():
+	return storage_backends[read_config("activity_storage") or "jsonl"]
+
+
+def activity_filepath(month, directory="data/saved_data"):
+	return get_activity_storage().filepath(month, directory)
+
+
+def find_activity_file(month, directory="data/saved_data"):
+	# Prefer the configured format, but fall back to months saved some other way
+	filepath = activity_filepath(month, directory)
+	if not os.path.exists(filepath):
+		for suffix in activity_suffixes:
+			if os.path.exists("{d}/{m}{s}".format(d=directory, m=month, s=suffix)):
+				return "{d}/{m}{s}".format(d=directory, m=month, s=suffix)
+	return filepath
+
+
+def remove_activity_files(month, directory="data/saved_data"):
+	for suffix in activity_suffixes:
+		try:
+			os.remove("{d}/{m}{s}".format(d=directory, m=month, s=suffix))
+		except FileNotFoundError:
+			pass
+
+
+def list_activity_files(directory, suffixes=activity_suffixes):
+	return ["{}/{}".format(directory, file) for file in sorted(os.listdir(directory)) if file.endswith(suffixes)]
+
+
+def migrate_activity_files(directory="data/saved_data"):
+	# Rewrites any month saved in another format, such as the old JSON arrays, into the configured one
+	storage = get_activity_storage()
+	remove_stale_migrations(directory)
+	for filepath in list_activity_files(directory):
+		if filepath.endswith(storage.suffix):
+			continue
+		month = os.path.basename(filepath).split("-")[0]
+		new_filepath = storage.filepath(month, directory)
+		temp_filepath = new_filepath + ".tmp"
+		print("Converting {o} to {n}".format(o=filepath, n=new_filepath))
+		storage.write(temp_filepath, iter_json_file(filepath))
+		os.replace(temp_filepath, new_filepath)
+		os.remove(filepath)
+
+
+def remove_stale_migrations(directory="data/saved_data"):
+	# Left behind by a migration that stopped partway; the original month file is still in place
+	for file in os.listdir(directory):
+		stale_temp = file.endswith(".tmp") and file[:-len(".tmp")].endswith(activity_suffixes)
+		if stale_temp or (file.startswith("tmp-") and file.endswith(activity_suffixes)):
+			os.remove("{}/{}".format(directory, file))
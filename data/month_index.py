@@ -0,0 +1,42 @@
+from data.io_interface import list_activity_files, iter_json_file, update_file_index
+
+index_file = "data/saved_data/month_index.json"
+
+
+def update_month_index(directory="data/saved_data"):
+	# Record counts and date bounds for every month file, so a report only opens the months it needs
+	return update_file_index(index_file, list_activity_files(directory), index_month_file)
+
+
+def index_month_file(filepath):
+	record_count = 0
+	first = None
+	last = None
+	for record in iter_json_file(filepath):
+		created = record["download"]["created"]
+		record_count += 1
+		if not first or created < first:
+			first = created
+		if not last or created > last:
+			last = created
+
+	return {"record_count": record_count,
+	        "first": first,
+	        "last": last}
+
+
+def select_month_files(start_month=None, end_month=None):
+	# Months are YYYYMM strings, and either end can be left open
+	selected = []
+	for filepath, entry in update_month_index().items():
+		if not entry["record_count"]:
+			continue
+		first_month = entry["first"][:4] + entry["first"][5:7]
+		last_month = entry["last"][:4] + entry["last"][5:7]
+		if start_month and last_month < start_month:
+			continue
+		if end_month and first_month > end_month:
+			continue
+		selected.append(filepath)
+
+	return selected
@@ -0,0 +1,159 @@
+import sqlite3
+from util.codec import json_dumps
+
+# Bumped whenever stored rows could be wrong for the current code, so older stores are rebuilt from the month files
+store_version = 1
+tables = ["sources", "downloads", "download_taxa", "download_locations", "download_predicates"]
+child_tables = ["download_taxa", "download_locations", "download_predicates"]
+schema = ["CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, fingerprint TEXT)",
+          "CREATE TABLE IF NOT EXISTS downloads (download_key TEXT PRIMARY KEY, source TEXT, position INTEGER, "
+          "created TEXT, doi TEXT, request_type TEXT, total_records INTEGER, te_papa_records INTEGER, "
+          "contribution_percentage REAL, included INTEGER)",
+          "CREATE TABLE IF NOT EXISTS download_taxa (download_key TEXT, taxon_key TEXT)",
+          "CREATE TABLE IF NOT EXISTS download_locations (download_key TEXT, location_type TEXT, value TEXT)",
+          "CREATE TABLE IF NOT EXISTS download_predicates (download_key TEXT, field TEXT, value TEXT)",
+          "CREATE INDEX IF NOT EXISTS downloads_source ON downloads (source)",
+          "CREATE INDEX IF NOT EXISTS downloads_created ON downloads (created)",
+          "CREATE INDEX IF NOT EXISTS downloads_contribution ON downloads (included, contribution_percentage)",
+          "CREATE INDEX IF NOT EXISTS download_taxa_key ON download_taxa (download_key)",
+          "CREATE INDEX IF NOT EXISTS download_taxa_taxon ON download_taxa (taxon_key)",
+          "CREATE INDEX IF NOT EXISTS download_locations_key ON download_locations (download_key)",
+          "CREATE INDEX IF NOT EXISTS download_locations_value ON download_locations (location_type, value)",
+          "CREATE INDEX IF NOT EXISTS download_predicates_key ON download_predicates (download_key)"]
+
+
+class ActivityStore():
+	def __init__(self, filepath="data/saved_data/analytics.db"):
+		self.filepath = filepath
+		self.connection = None
+
+	def connect(self):
+		if not self.connection:
+			self.connection = sqlite3.connect(self.filepath)
+			if self.connection.execute("PRAGMA user_version").fetchone()[0] != store_version:
+				with self.connection:
+					for table in tables:
+						self.connection.execute("DROP TABLE IF EXISTS {}".format(table))
+					self.connection.execute("PRAGMA user_version = {}".format(store_version))
+			for statement in schema:
+				self.connection.execute(statement)
+		return self.connection
+
+	def is_current(self, source, fingerprint):
+		row = self.connect().execute("SELECT fingerprint FROM sources WHERE source = ?", (source,)).fetchone()
+		return row is not None and row[0] == json_dumps(fingerprint)
+
+	def replace_source(self, source, fingerprint, rows):
+		# Swap out everything loaded from one month's file in a single transaction
+		connection = self.connect()
+		with connection:
+			self.delete_source(source)
+			for download, taxa, download_locations, predicates in rows:
+				# A download already stored from another file loses its old rows, so nothing is counted twice
+				for table in child_tables:
+					connection.execute("DELETE FROM {} WHERE download_key = ?".format(table), (download[0],))
+				connection.execute("INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", download)
+				connection.executemany("INSERT INTO download_taxa VALUES (?, ?)", taxa)
+				connection.executemany("INSERT INTO download_locations VALUES (?, ?, ?)", download_locations)
+				connection.executemany("INSERT INTO download_predicates VALUES (?, ?, ?)", predicates)
+			connection.execute("INSERT OR REPLACE INTO sources VALUES (?, ?)", (source, json_dumps(fingerprint)))
+
+	def remove_missing_sources(self, sources):
+		# Month files that were renamed or deleted take their rows with them
+		connection = self.connect()
+		stored_sources = [row[0] for row in connection.execute("SELECT source FROM sources").fetchall()]
+		with connection:
+			for source in stored_sources:
+				if source not in sources:
+					self.delete_source(source)
+					connection.execute("DELETE FROM sources WHERE source = ?", (source,))
+
+	def delete_source(self, source):
+		for table in child_tables:
+			self.connection.execute("DELETE FROM {} WHERE download_key IN "
+			                        "(SELECT download_key FROM downloads WHERE source = ?)".format(table), (source,))
+		self.connection.execute("DELETE FROM downloads WHERE source = ?", (source,))
+
+	def window(self, start=None, end=None):
+		# Dates are ISO strings, so a prefix such as 2024-09 bounds a range with plain comparisons
+		clauses = []
+		params = []
+		if start:
+			clauses.append("d.created >= ?")
+			params.append(start)
+		if end:
+			clauses.append("d.created < ?")
+			params.append(end)
+		if not clauses:
+			return "1 = 1", params
+		return " AND ".join(clauses), params
+
+	def count_downloads(self, start=None, end=None):
+		where, params = self.window(start, end)
+		return self.connect().execute("SELECT COUNT(*) FROM downloads d WHERE {}".format(where), params).fetchone()[0]
+
+	def taxon_counts(self, start=None, end=None):
+		where, params = self.window(start, end)
+		return self.connect().execute("SELECT t.taxon_key, COUNT(*) FROM download_taxa t "
+		                              "JOIN downloads d ON d.download_key = t.download_key "
+		                              "WHERE {} GROUP BY t.taxon_key ORDER BY COUNT(*) DESC".format(where),
+		                              params).fetchall()
+
+	def location_counts(self, start=None, end=None):
+		where, params = self.window(start, end)
+		return self.connect().execute("SELECT l.location_type, l.value, COUNT(*) FROM download_locations l "
+		                              "JOIN downloads d ON d.download_key = l.download_key "
+		                              "WHERE {} GROUP BY l.location_type, l.value "
+		                              "ORDER BY COUNT(*) DESC".format(where), params).fetchall()
+
+	def predicate_counts(self, start=None, end=None):
+		where, params = self.window(start, end)
+		return self.connect().execute("SELECT p.field, p.value, COUNT(*) FROM download_predicates p "
+		                              "JOIN downloads d ON d.download_key = p.download_key "
+		                              "WHERE {} GROUP BY p.field, p.value".format(where), params).fetchall()
+
+	def top_contributions(self, count, start=None, end=None):
+		where, params = self.window(start, end)
+		connection = self.connect()
+		rows = connection.execute("SELECT d.download_key, d.source, d.position, d.created, d.doi, d.request_type, "
+		                          "d.total_records, d.te_papa_records, d.contribution_percentage FROM downloads d "
+		                          "WHERE d.included = 1 AND {} "
+		                          "ORDER BY d.contribution_percentage DESC LIMIT ?".format(where),
+		                          params + [count]).fetchall()
+		top = []
+		for row in rows:
+			taxon_keys = connection.execute("SELECT DISTINCT taxon_key FROM download_taxa WHERE download_key = ?",
+			                                (row[0],)).fetchall()
+			download_locations = connection.execute("SELECT DISTINCT value FROM download_locations "
+			                                        "WHERE download_key = ?", (row[0],)).fetchall()
+			top.append({"activity_key": row[0],
+			            "source": row[1],
+			            "position": row[2],
+			            "created": row[3],
+			            "doi": row[4],
+			            "request_type": row[5],
+			            "total_records": row[6],
+			            "te_papa_records": row[7],
+			            "contribution_percentage": row[8],
+			            "taxon_keys": [i[0] for i in taxon_keys],
+			            "locations": [i[0] for i in download_locations]})
+		return top
+
+	def summarise(self, top_k, start=None, end=None):
+		# Same shape as a merged set of month summaries, so it can be applied the same way
+		predicates = {}
+		for field, value, count in self.predicate_counts(start, end):
+			predicates.setdefault(field, {})[value] = count
+		locations = {}
+		for location_type, value, count in self.location_counts(start, end):
+			locations.setdefault(location_type, {})[value] = count
+		return {"record_count": self.count_downloads(start, end),
+		        "taxa": dict(self.taxon_counts(start, end)),
+		        "locations": locations,
+		        "predicates": predicates,
+		        "top": self.top_contributions(top_k, start, end)}
+
+	def close(self):
+		if self.connection:
+			self.connection.close()
+			self.connection = None
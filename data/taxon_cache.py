@@ -0,0 +1,68 @@
+import sqlite3
+import threading
+import time
+from util.codec import json_loads, json_dumps
+from util.config import read_config
+from util.metrics import metrics
+
+
+class TaxonCache():
+	def __init__(self, filepath="data/saved_data/taxon_cache.db"):
+		self.filepath = filepath
+		self.connection = None
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def connect(self):
+		if not self.connection:
+			self.connection = sqlite3.connect(self.filepath, check_same_thread=False)
+			self.connection.execute("CREATE TABLE IF NOT EXISTS taxa "
+			                        "(usage_key TEXT PRIMARY KEY, data TEXT, fetched REAL, last_used REAL)")
+			self.connection.execute("CREATE INDEX IF NOT EXISTS taxa_last_used ON taxa (last_used)")
+		return self.connection
+
+	def get(self, usage_key):
+		ttl = (read_config("taxon_cache_ttl_days") or 90) * 86400
+		now = time.time()
+		with self.lock:
+			connection = self.connect()
+			row = connection.execute("SELECT data, fetched FROM taxa WHERE usage_key = ?", (str(usage_key),)).fetchone()
+			if row and now - row[1] < ttl:
+				self.hits += 1
+				metrics.count("taxon_cache_hits")
+				connection.execute("UPDATE taxa SET last_used = ? WHERE usage_key = ?", (now, str(usage_key)))
+				return json_loads(row[0])
+
+			self.misses += 1
+			metrics.count("taxon_cache_misses")
+			return None
+
+	def put(self, usage_key, data):
+		now = time.time()
+		with self.lock:
+			connection = self.connect()
+			connection.execute("INSERT OR REPLACE INTO taxa VALUES (?, ?, ?, ?)",
+			                   (str(usage_key), json_dumps(data), now, now))
+			self.evict()
+			connection.commit()
+
+	def evict(self):
+		# Drop the least recently used entries once the cache is over its size limit
+		max_size = read_config("taxon_cache_size") or 50000
+		size = self.connection.execute("SELECT COUNT(*) FROM taxa").fetchone()[0]
+		if size > max_size:
+			self.connection.execute("DELETE FROM taxa WHERE usage_key IN "
+			                        "(SELECT usage_key FROM taxa ORDER BY last_used LIMIT ?)", (size - max_size,))
+
+	def save(self):
+		with self.lock:
+			if self.connection:
+				self.connection.commit()
+
+	def report(self):
+		lookups = self.hits + self.misses
+		if lookups:
+			print("Taxon cache: {h} hits, {m} misses ({p}% hit rate)".format(h=self.hits,
+			                                                                 m=self.misses,
+			                                                                 p=round(self.hits / lookups * 100, 1)))
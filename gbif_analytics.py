@@ -1,8 +1,10 @@
 from data.download import download_activity, download_citations
+from data.io_interface import migrate_activity_files
 from util.config import load_config, read_config
-from util.processing import process_activity_data, find_greatest_proportion
+from util.processing import process_activity_data, find_greatest_proportion, resolve_taxa
 from util.export import export_proportion_report, export_report_data
-from report import report
+from util.metrics import metrics
+from util.pipeline import run_pipeline
 import cProfile
 import pstats
 
@@ -14,17 +16,30 @@ import pstats
 # Find and sort out the weirdnesses
 
 def run_analytics():
-	if read_config("download_mode"):
+	migrate_activity_files()
+	if read_config("download_mode") and read_config("pipeline_mode"):
+		run_pipeline(read_config("dataset_id"), read_config("download_mode"))
+	elif read_config("download_mode"):
 		dataset_id = read_config("dataset_id")
 		download_mode = read_config("download_mode")
-		download_activity(dataset_id, download_mode)
-		download_citations(dataset_id)
-		process_activity_data()
-		sorted_records = find_greatest_proportion()
-		export_proportion_report(sorted_records)
-		export_report_data()
+		with metrics.stage("download", records_counter="activity_records_downloaded"):
+			download_activity(dataset_id, download_mode)
+			download_citations(dataset_id)
+		with metrics.stage("process", records_counter="records_loaded"):
+			process_activity_data()
+		with metrics.stage("rank"):
+			sorted_records = find_greatest_proportion()
+			resolve_taxa()
+		with metrics.stage("export"):
+			export_proportion_report(sorted_records)
+			export_report_data()
 
-	report.run()
+	with metrics.stage("report"):
+		# Imported here so download-only and no-PDF runs skip the report dependencies until they're needed
+		from report import report
+		report.run()
+
+	metrics.write_summary()
 
 if __name__ == "__main__":
 	load_config("util/config.yaml")
@@ -0,0 +1,85 @@
+import os
+import hashlib
+from data.io_interface import read_json_file, replace_json_file
+from util.codec import json_dumps
+from util.metrics import metrics
+
+cache_directory = "data/saved_data/render_cache"
+
+
+class RenderCache():
+	# Rendered blocks are saved under a hash of their inputs and templates, so unchanged blocks are never
+	# rendered twice. Output files (CSVs, the PDF) remember the hash they were written from in a manifest
+	def __init__(self, env, directory=cache_directory, enabled=True):
+		self.env = env
+		self.directory = directory
+		self.enabled = enabled
+		self.manifest_file = os.path.join(directory, "manifest.json")
+		self.manifest = None
+		self.used_blocks = set()
+
+	def key(self, inputs, templates=()):
+		content_hash = hashlib.sha256(json_dumps(inputs, sort_keys=True).encode("utf-8"))
+		for template_name in templates:
+			template_source = self.env.loader.get_source(self.env, template_name)[0]
+			content_hash.update(template_source.encode("utf-8"))
+		return content_hash.hexdigest()
+
+	def block(self, templates, inputs, build):
+		if not self.enabled:
+			return build()
+
+		block_name = "{}.html".format(self.key(inputs, templates))
+		self.used_blocks.add(block_name)
+		block_file = os.path.join(self.directory, block_name)
+		if os.path.exists(block_file):
+			metrics.count("report_blocks_reused")
+			with open(block_file, "r", encoding="utf-8") as f:
+				return f.read()
+
+		html = build()
+		metrics.count("report_blocks_rendered")
+		# Replaced in one step, so an interrupted run never leaves a cut-off block to be reused
+		os.makedirs(self.directory, exist_ok=True)
+		temp_file = block_file + ".tmp"
+		with open(temp_file, "w", encoding="utf-8") as f:
+			f.write(html)
+		os.replace(temp_file, block_file)
+		return html
+
+	def prune(self, report_name):
+		# Each report keeps the blocks from its latest run, so reports for different months or periods can
+		# run one after another without evicting each other. Blocks no report uses any more are removed
+		if not self.enabled or not os.path.isdir(self.directory):
+			return
+		manifest = self.load_manifest()
+		report_blocks = manifest.setdefault("report_blocks", {})
+		report_blocks[report_name] = sorted(self.used_blocks)
+		replace_json_file(self.manifest_file, manifest)
+
+		kept_blocks = set()
+		for block_names in report_blocks.values():
+			kept_blocks.update(block_names)
+		for file in os.listdir(self.directory):
+			if (file.endswith(".html") and file not in kept_blocks) or file.endswith(".html.tmp"):
+				os.remove(os.path.join(self.directory, file))
+
+	def output_is_current(self, output_file, key):
+		if not self.enabled or not os.path.exists(output_file):
+			return False
+		return self.load_manifest().get(output_file) == key
+
+	def record_output(self, output_file, key):
+		if not self.enabled:
+			return
+		manifest = self.load_manifest()
+		manifest[output_file] = key
+		os.makedirs(self.directory, exist_ok=True)
+		replace_json_file(self.manifest_file, manifest)
+
+	def load_manifest(self):
+		if self.manifest is None:
+			self.manifest = {}
+			if os.path.exists(self.manifest_file):
+				self.manifest = read_json_file(self.manifest_file) or {}
+		return self.manifest
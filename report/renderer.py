@@ -0,0 +1,97 @@
+import os
+import atexit
+import asyncio
+import threading
+from util.config import read_config
+
+renderer = None
+
+
+class PdfRenderer():
+	# Keeps one Chromium running with a few pages open, so each PDF costs a render rather than a browser start.
+	# Playwright runs on its own event loop in a background thread, and callers just block on the result
+	def __init__(self, page_count=None, css_path="templates/print.css"):
+		self.page_count = page_count or read_config("pdf_pages") or 2
+		self.css_path = os.path.abspath(css_path)
+		self.loop = None
+		self.thread = None
+		self.playwright = None
+		self.browser = None
+		self.pages = None
+		self.lock = threading.Lock()
+
+	def start(self):
+		with self.lock:
+			if self.loop:
+				return
+			self.loop = asyncio.new_event_loop()
+			self.thread = threading.Thread(target=self.loop.run_forever, name="pdf-renderer", daemon=True)
+			self.thread.start()
+			try:
+				self.call(self.launch())
+			except Exception:
+				self.stop()
+				raise
+
+	def call(self, coroutine):
+		return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+	async def launch(self):
+		# Playwright is slow to import, so runs that never make a PDF never load it
+		from playwright.async_api import async_playwright
+		self.playwright = await async_playwright().start()
+		self.browser = await self.playwright.chromium.launch()
+		self.pages = asyncio.Queue()
+		for _ in range(self.page_count):
+			page = await self.browser.new_page()
+			await page.emulate_media(media="screen")
+			self.pages.put_nowait(page)
+
+	def render(self, html, pdf_path):
+		self.render_batch([(html, pdf_path)])
+
+	def render_batch(self, jobs):
+		# jobs are (html, pdf_path) pairs, rendered as pages in the pool come free
+		self.start()
+		self.call(self.render_all(jobs))
+
+	async def render_all(self, jobs):
+		await asyncio.gather(*(self.render_page(html, pdf_path) for html, pdf_path in jobs))
+
+	async def render_page(self, html, pdf_path):
+		page = await self.pages.get()
+		try:
+			# The page has no file URL to load print.css from, so it goes in as a style tag instead
+			await page.set_content(html, wait_until="load")
+			await page.add_style_tag(path=self.css_path)
+			await page.pdf(path=pdf_path, landscape=True, scale=0.9)
+		finally:
+			self.pages.put_nowait(page)
+
+	def close(self):
+		with self.lock:
+			if self.loop:
+				self.stop()
+
+	def stop(self):
+		self.call(self.shut_down())
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.thread.join()
+		self.loop.close()
+		self.loop = None
+
+	async def shut_down(self):
+		if self.browser:
+			await self.browser.close()
+			self.browser = None
+		if self.playwright:
+			await self.playwright.stop()
+			self.playwright = None
+
+
+def get_renderer():
+	global renderer
+	if not renderer:
+		renderer = PdfRenderer()
+		atexit.register(renderer.close)
+	return renderer
@@ -1,19 +1,37 @@
 import os
-import yaml
 import csv
-try:
-	from yaml import CLoader as Loader, CDumper as Dumper
-except ImportError:
-	from yaml import Loader, Dumper
-from jinja2 import Environment, PackageLoader, select_autoescape
 from util.config import read_config
-from data.io_interface import read_json_file
+from data.io_interface import read_json_file, update_file_index
+from util.codec import yaml_load, yaml_dump
+from report.render_cache import RenderCache
 
-from playwright.sync_api import sync_playwright as pw
-
-env = Environment(loader=PackageLoader("gbif_analytics"),
-                  autoescape=select_autoescape())
 save_file = "data/report_data/report_data.yaml"
+template_cache_directory = "data/saved_data/template_cache"
+export_counts_cache_file = "data/saved_data/export_counts_cache.json"
+env = None
+render_cache = None
+
+
+def get_env():
+	# Jinja is only loaded once a report is built, and compiled templates are kept on disk between runs
+	global env
+	if not env:
+		from jinja2 import Environment, PackageLoader, select_autoescape, FileSystemBytecodeCache
+		bytecode_cache = None
+		if read_config("template_bytecode_cache") is not False:
+			os.makedirs(template_cache_directory, exist_ok=True)
+			bytecode_cache = FileSystemBytecodeCache(template_cache_directory)
+		env = Environment(loader=PackageLoader("gbif_analytics"),
+		                  autoescape=select_autoescape(),
+		                  bytecode_cache=bytecode_cache)
+	return env
+
+
+def get_render_cache():
+	global render_cache
+	if not render_cache:
+		render_cache = RenderCache(get_env(), enabled=read_config("report_render_cache") is not False)
+	return render_cache
 
 
 def load_analytics_data():
@@ -27,25 +45,35 @@ def load_analytics_data():
 def read_export_counts():
 	export_counts = {}
 	total_records_count = 0
-	for ex in os.listdir("data/export_counts"):
-		with open("data/export_counts/{}".format(ex), "r", encoding="utf-8") as f:
-			count_data = yaml.load(f, Loader=Loader)
-			year = count_data["year"]
-			if not export_counts.get(year):
-				export_counts[year] = {}
-			month = count_data["month"]
-			export_counts[year][month] = count_data
+	for count_data in load_export_count_files():
+		year = count_data["year"]
+		if not export_counts.get(year):
+			export_counts[year] = {}
+		month = count_data["month"]
+		export_counts[year][month] = count_data
 
-			total_records_count = count_data["records_written"]["core"]
+		total_records_count = count_data["records_written"]["core"]
 
 	return export_counts, total_records_count
 
 
+def load_export_count_files(directory="data/export_counts"):
+	# Parsed export counts are kept together in one file, and a YAML file is only parsed again once it changes
+	filepaths = ["{d}/{f}".format(d=directory, f=ex) for ex in os.listdir(directory)]
+	export_count_files = update_file_index(export_counts_cache_file, filepaths, read_export_count_file)
+	return [entry["count_data"] for entry in export_count_files.values()]
+
+
+def read_export_count_file(filepath):
+	with open(filepath, "r", encoding="utf-8") as f:
+		return {"count_data": yaml_load(f)}
+
+
 def get_export_stats():
 	update_file = "data/report_data/newexportstats.yaml"
 	export_data = {"recordCounts": {}, "additions": {}, "updates": {}}
 	with open(update_file, "r", encoding="utf-8") as f:
-		update_data = yaml.load(f, Loader=Loader)
+		update_data = yaml_load(f)
 		export_data["recordCounts"] = update_data["records_written"]
 		export_data["additions"] = update_data["new_record_counts"]
 		export_data["updates"] = update_data["update_counts"]
@@ -54,9 +82,9 @@ def get_export_stats():
 
 	# TODO: Only update file if this data is missing
 	with open("data/report_data/exportstatsmonthly.yaml", "w", encoding="utf-8") as f:
-		saved_export_data = yaml.load(f, Loader=Loader)
+		saved_export_data = yaml_load(f)
 		saved_export_data[export_year][export_month] = export_data
-		yaml.dump(export_data, f)
+		yaml_dump(export_data, f)
 
 	return saved_export_data
 
@@ -66,7 +94,7 @@ def get_analytics_data():
 	analytics_data = None
 	try:
 		with open(analytics_file, "r", encoding="utf-8") as f:
-			analytics_data = yaml.load(f, Loader=Loader)
+			analytics_data = yaml_load(f)
 	except IOError:
 		print("No saved data found")
 
@@ -76,7 +104,7 @@ def get_analytics_data():
 def load_saved_data():
 	if os.path.exists(save_file):
 		with open(save_file, "r", encoding="utf-8") as f:
-			saved_data = yaml.load(f, Loader=Loader)
+			saved_data = yaml_load(f)
 			return saved_data
 	else:
 		return {}
@@ -85,35 +113,64 @@ def load_saved_data():
 def save_updated_data(data):
 	with open(save_file, "w+", encoding="utf-8") as f:
 		f.seek(0)
-		yaml.dump(data, f, Dumper=Dumper)
+		yaml_dump(data, f)
 		f.truncate()
 
 
 def build_report_blocks(analytics_data, export_counts, total_records_count):
 	# TODO: Probably some fixing up here I dunno
-	monthly_counts, mc_columns = build_monthly_counts_data(export_counts)
-
-	print("Building record counts")
-	counts_block = build_record_counts_block(monthly_counts, mc_columns)
-	write_to_csv("monthlycounts", monthly_counts, mc_columns)
+	# Each block is only rendered, and each CSV only written, when its inputs or templates have changed
+	render_cache = get_render_cache()
+	counts_block = render_counts(export_counts)
 
 	print("Building total counts")
-	totals_block = build_total_counts_block(total_records_count)
+	metadata = read_json_file("data/saved_data/saved_metadata.json")
+	totals_block = render_cache.block(["newrecords.html"], [total_records_count, metadata],
+	                                  lambda: build_total_counts_block(total_records_count, metadata))
 
-	print("Building citations")
-	citations_data = read_json_file("data/saved_data/citations.json")
-	write_citations(citations_data)
-	citations = build_citations_block(citations_data)
+	citations = render_citations()
 
 	print("Building downloads")
-	downloads = build_downloads_block(analytics_data["downloads"])
+	downloads = render_cache.block(["download.html"], [analytics_data["downloads"], report_period()],
+	                               lambda: build_downloads_block(analytics_data["downloads"]))
 
 	print("Building strengths")
-	strengths = build_strengths_block(analytics_data["strengths"])
+	strengths = render_cache.block(["strengths.html"], [analytics_data["strengths"], report_period()],
+	                               lambda: build_strengths_block(analytics_data["strengths"]))
 
 	return counts_block, totals_block, citations, downloads, strengths
 
 
+def render_counts(export_counts):
+	print("Building record counts")
+	monthly_counts, mc_columns = build_monthly_counts_data(export_counts)
+	render_cache = get_render_cache()
+	counts_block = render_cache.block(["count.html", "counttable.html"], [monthly_counts, mc_columns],
+	                                  lambda: build_record_counts_block(monthly_counts, mc_columns))
+	write_csv_if_changed("report/report_outputs/monthlycounts.csv", [monthly_counts, mc_columns],
+	                     lambda: write_to_csv("monthlycounts", monthly_counts, mc_columns))
+	return counts_block
+
+
+def render_citations():
+	print("Building citations")
+	citations_data = read_json_file("data/saved_data/citations.json")
+	write_csv_if_changed("report/report_outputs/citations.csv", citations_data,
+	                     lambda: write_citations(citations_data))
+	return get_render_cache().block(["citation.html"], citations_data,
+	                                lambda: build_citations_block(citations_data))
+
+
+def prerender_blocks():
+	# Fills the render cache with the blocks that don't need the analytics results, so the pipeline can
+	# render them while activity is still downloading and the report stage finds them ready
+	if not get_render_cache().enabled:
+		return
+	export_counts, total_records_count = read_export_counts()
+	render_counts(export_counts)
+	render_citations()
+
+
 def build_monthly_counts_data(data):
 	download_stats = load_activity_by_month()
 	columns = []
@@ -132,11 +189,7 @@ def build_monthly_counts_data(data):
 			date_string = str(year) + str(month)
 			columns.append(date_string)
 
-			activity_count_list = [i["count"] for i in download_stats if (i["year"] == year) and (i["month"] == month)]
-			if activity_count_list:
-				activity_count = activity_count_list[0]
-			else:
-				activity_count = None
+			activity_count = download_stats.get((year, month))
 
 			counts_table["Activity by month"].append({"date": date_string,
 			                                          "value": activity_count})
@@ -183,13 +236,13 @@ def build_monthly_counts_data(data):
 
 
 def load_activity_by_month():
-	download_counts = []
+	# Keyed by (year, month), so each cell of the counts table is a single lookup
+	download_counts = {}
 	with open("data/saved_data/downloads_statistics.tsv", "r", encoding="utf-8") as f:
 		reader = csv.DictReader(f, delimiter="\t")
 		for row in reader:
-			download_counts.append({"year": int(row["year"]),
-			                        "month": int(row["month"]),
-			                        "count": int(row["number_downloads"])})
+			# The first row for a month wins, as it did when the list was scanned
+			download_counts.setdefault((int(row["year"]), int(row["month"])), int(row["number_downloads"]))
 
 	return download_counts
 
@@ -210,12 +263,19 @@ def write_to_csv(label, data, headers):
 			writer.writerow(write_values)
 
 
-def build_total_counts_block(total_records_count):
+def write_csv_if_changed(csv_file, inputs, write):
+	render_cache = get_render_cache()
+	key = render_cache.key(inputs)
+	if not render_cache.output_is_current(csv_file, key):
+		write()
+		render_cache.record_output(csv_file, key)
+
+
+def build_total_counts_block(total_records_count, metadata):
 	print(total_records_count)
-	metadata = read_json_file("data/saved_data/saved_metadata.json")
 	try:
 		download_count = metadata["total_count"]
-		count_template = env.get_template("newrecords.html")
+		count_template = get_env().get_template("newrecords.html")
 		count_html = count_template.render(total_record_count=total_records_count,
 	                                       download_count=download_count)
 		return count_html
@@ -225,7 +285,7 @@ def build_total_counts_block(total_records_count):
 
 def build_record_counts_block(data, columns):
 	table = create_count_table(data, columns)
-	count_template = env.get_template("count.html")
+	count_template = get_env().get_template("count.html")
 	count_html = count_template.render(table=table)
 
 	return count_html
@@ -243,7 +303,7 @@ def create_count_table(data, columns):
 			values_dict["values"].append(value)
 		rows.append(values_dict)
 
-	table_template = env.get_template("counttable.html")
+	table_template = get_env().get_template("counttable.html")
 	table_html = table_template.render(columns=columns,
 	                                   rows=rows)
 
@@ -253,7 +313,7 @@ def create_count_table(data, columns):
 def build_citations_block(cite_data):
 	cite_count = cite_data["count"]
 	latest_citation = cite_data["publications"][0]
-	citation_template = env.get_template("citation.html")
+	citation_template = get_env().get_template("citation.html")
 	citation_html = citation_template.render(cite_count=cite_count,
 	                                         latest_citation=latest_citation)
 	return citation_html
@@ -281,22 +341,26 @@ def write_citations(data):
 
 
 def build_downloads_block(download_data):
-	if read_config("report_mode") == "full":
-		downloads_header = "Biggest contributions"
-	else:
-		downloads_header = "Biggest contributions this month"
-	download_template = env.get_template("download.html")
+	downloads_header = "Biggest contributions" + report_period()
+	download_template = get_env().get_template("download.html")
 	download_html = download_template.render(downloads=download_data,
 	                                         downloads_header=downloads_header)
 	return download_html
 
 
-def build_strengths_block(strengths_data):
-	if read_config("report_mode") == "full":
-		strengths_header = "Dataset strengths"
+def report_period():
+	report_mode = str(read_config("report_mode"))
+	if report_mode == "full":
+		return ""
+	elif report_mode == "month" or report_mode.isdigit():
+		return " this month"
 	else:
-		strengths_header = "Dataset strengths this month"
-	strengths_template = env.get_template("strengths.html")
+		return " for {}".format(report_mode)
+
+
+def build_strengths_block(strengths_data):
+	strengths_header = "Dataset strengths" + report_period()
+	strengths_template = get_env().get_template("strengths.html")
 	taxa_data = strengths_data["taxa"]
 	loc_data = strengths_data["locations"]
 	strengths_html = strengths_template.render(taxa=taxa_data,
@@ -308,7 +372,7 @@ def build_strengths_block(strengths_data):
 def combine_blocks(counts_block, totals_block, citations, downloads, strengths):
 	print("Building main")
 	main_css = "file://{}".format(os.path.abspath("templates/print.css"))
-	main_template = env.get_template("main.html")
+	main_template = get_env().get_template("main.html")
 	main_html = main_template.render(total_counts=totals_block,
 	                                 citations=citations,
 	                                 downloads=downloads,
@@ -318,17 +382,32 @@ def combine_blocks(counts_block, totals_block, citations, downloads, strengths):
 	return main_html
 
 
-def create_pdf(html):
-	html_file = "report/report_outputs/analyticspage.html"
-	with open(html_file, "w+", encoding="utf-8") as outfile:
-		outfile.write(html)
+def create_pdf(html, html_file="report/report_outputs/analyticspage.html",
+               pdf_file="report/report_outputs/analyticspdf.pdf"):
+	create_pdfs([(html, html_file, pdf_file)])
 
-	with pw() as p:
-		browser = p.chromium.launch()
-		page = browser.new_page()
-		page.goto("file://{}".format(os.path.abspath(html_file)))
-		page.emulate_media(media="screen")
-		page.pdf(path="report/report_outputs/analyticspdf.pdf", landscape=True, scale=0.9)
+
+def create_pdfs(reports):
+	# reports are (html, html_file, pdf_file) sets, e.g. one per month when backfilling, all rendered
+	# from memory by the one shared browser. The HTML is still saved alongside for checking by eye.
+	# A PDF is only rendered again when its HTML or print.css has changed
+	with open("templates/print.css", "r", encoding="utf-8") as f:
+		print_css = f.read()
+
+	render_cache = get_render_cache()
+	changed = []
+	for html, html_file, pdf_file in reports:
+		with open(html_file, "w+", encoding="utf-8") as outfile:
+			outfile.write(html)
+		key = render_cache.key([html, print_css])
+		if not render_cache.output_is_current(pdf_file, key):
+			changed.append((html, pdf_file, key))
+
+	if changed:
+		from report.renderer import get_renderer
+		get_renderer().render_batch([(html, pdf_file) for html, pdf_file, key in changed])
+	for html, pdf_file, key in changed:
+		render_cache.record_output(pdf_file, key)
 
 
 def run():
@@ -337,7 +416,12 @@ def run():
 	                                                                                  export_counts,
 	                                                                                  total_records_count)
 	full_html = combine_blocks(counts_block, totals_block, citations, downloads, strengths)
-	create_pdf(full_html)
+	get_render_cache().prune(str(read_config("report_mode")))
+	if read_config("report_pdf") is not False:
+		create_pdf(full_html)
+	else:
+		with open("report/report_outputs/analyticspage.html", "w+", encoding="utf-8") as outfile:
+			outfile.write(full_html)
 	# TODO: Create CSV output for PowerBI report
 
 
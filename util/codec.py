@@ -0,0 +1,46 @@
+import json
+import yaml
+try:
+	import orjson
+except ImportError:
+	orjson = None
+try:
+	from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+	from yaml import SafeLoader, SafeDumper
+
+# Every JSON and YAML read or write goes through here, so the fast C backends are used wherever they're installed
+JSONDecodeError = json.JSONDecodeError
+
+
+def json_loads(text):
+	if orjson:
+		return orjson.loads(text)
+	return json.loads(text)
+
+
+def json_dumps(content, indent=None, sort_keys=False):
+	if orjson:
+		options = orjson.OPT_NON_STR_KEYS
+		if indent:
+			options |= orjson.OPT_INDENT_2
+		if sort_keys:
+			options |= orjson.OPT_SORT_KEYS
+		return orjson.dumps(content, option=options).decode("utf-8")
+	return json.dumps(content, indent=indent, sort_keys=sort_keys, default=str)
+
+
+def json_load(f):
+	return json_loads(f.read())
+
+
+def json_dump(content, f, indent=None):
+	f.write(json_dumps(content, indent=indent))
+
+
+def yaml_load(f):
+	return yaml.load(f, Loader=SafeLoader)
+
+
+def yaml_dump(content, f):
+	yaml.dump(content, f, Dumper=SafeDumper)
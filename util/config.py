@@ -1,4 +1,4 @@
-import yaml
+from util.codec import yaml_load
 
 config = {}
 
@@ -6,7 +6,7 @@ config = {}
 def load_config(config_file):
 	global config
 	with open(config_file, "r", encoding="utf-8") as f:
-		config = yaml.safe_load(f)
+		config = yaml_load(f)
 
 
 def read_config(key):
@@ -16,3 +16,12 @@ def read_config(key):
 def write_config(key, value):
 	config[key] = value
 	return value
+
+
+def copy_config():
+	return dict(config)
+
+
+def set_config(values):
+	global config
+	config = values
@@ -1,6 +1,6 @@
-import yaml
-from data.datastore import (activity_memo, activity_data, taxon_memo, taxon_data, location_memo)
-from util.processing import sort_activity_records, get_taxon_record_values
+from data.datastore import (activity_data, taxon_data, location_memo, predicate_memo)
+from util.processing import sort_activity_records, get_taxon_record_values, top_taxa
+from util.codec import yaml_dump
 
 
 def export_report_data():
@@ -9,27 +9,30 @@ def export_report_data():
 	print(downloads)
 	print(strengths)
 	with open("data/report_data/report_data.yaml", "w", encoding="utf-8") as f:
-		yaml.dump({"downloads": downloads,
+		yaml_dump({"downloads": downloads,
 		           "strengths": strengths}, f)
 
+	taxon_data.cache.save()
+	taxon_data.cache.report()
+
 
 def export_downloads():
 	sorted_records = sort_activity_records(10)
-	download_data = [flatten_record(record) for record in sorted_records]
+	download_data = [flatten_record(record).to_dict() for record in sorted_records]
 	return download_data
 
 
 def flatten_record(record):
 	if not record.flattened:
-		record.main_predicates["taxa"] = flatten_taxa(record)
-		record.main_predicates["locations"] = flatten_locations(record)
+		record.main_predicates = {"taxa": flatten_taxa(record),
+		                          "locations": flatten_locations(record)}
 		record.flattened = True
 
 	return record
 
 
 def flatten_taxa(record):
-	record_keys = activity_memo[record.activity_key]["taxon_keys"]
+	record_keys = record.taxon_keys
 	truncate_keys = False
 	if len(record_keys) > 5:
 		truncate_keys = True
@@ -49,7 +52,7 @@ def flatten_taxa(record):
 
 
 def flatten_locations(record):
-	record_locations = activity_memo[record.activity_key]["locations"]
+	record_locations = record.locations
 	for location in record_locations:
 		# TODO: Add lookup
 		pass
@@ -58,20 +61,16 @@ def flatten_locations(record):
 
 def export_strengths():
 	strengths = {"taxa": list_taxa_strengths(),
-	             "locations": list_location_strengths()}
+	             "locations": list_location_strengths(),
+	             "predicates": list_predicate_strengths()}
 	return strengths
 
 
 def list_taxa_strengths():
-	sorted_taxa = sorted([{"taxon_key": taxon_key,
-	                       "count": taxon_memo[taxon_key]["count"]} for taxon_key in list(taxon_memo.keys())],
-	                     key=lambda taxon: taxon["count"],
-	                     reverse=True)
-	top_taxa = sorted_taxa[:10]
 	taxon_strengths = []
-	for taxon in top_taxa:
-		taxon_strengths.append({"label": get_taxon_record_values([taxon["taxon_key"]], "scientificName"),
-		                        "count": taxon["count"]})
+	for taxon_key, count in top_taxa(10):
+		taxon_strengths.append({"label": get_taxon_record_values([taxon_key], "scientificName"),
+		                        "count": count})
 
 	return taxon_strengths
 
@@ -90,11 +89,20 @@ def list_location_strengths():
 	return location_strengths
 
 
+def list_predicate_strengths():
+	predicate_strengths = {}
+	for field, value_counts in predicate_memo.items():
+		top_values = sorted(value_counts.items(), key=lambda value: value[1], reverse=True)[:10]
+		predicate_strengths[field] = [{"label": label, "count": count} for label, count in top_values]
+
+	return predicate_strengths
+
+
 def list_activity():
 	for activity_record in activity_data.data:
 		download_key = activity_record.activity_key
-		tp_record_count = activity_record.data["numberRecords"]
-		download_record_count = activity_record.data["download"]["totalRecords"]
+		tp_record_count = activity_record.te_papa_records
+		download_record_count = activity_record.total_records
 		print("{d} used {n} records, {tp} from Te Papa".format(d=download_key,
 		                                                       n=download_record_count,
 		                                                       tp=tp_record_count))
@@ -104,9 +112,9 @@ def write_activity():
 	lines = []
 	for activity_record in activity_data.data:
 		download_key = activity_record.activity_key
-		download_doi = activity_record["download"]["doi"]
-		tp_record_count = activity_record["numberRecords"]
-		download_record_count = activity_record["download"]["totalRecords"]
+		download_doi = activity_record.doi
+		tp_record_count = activity_record.te_papa_records
+		download_record_count = activity_record.total_records
 		lines.append("{d} ({dk}) used {n} records, {tp} from Te Papa\n".format(d=download_key,
 		                                                                       dk=download_doi,
 			                                                                   n=download_record_count,
@@ -126,7 +134,7 @@ def format_report_string(record):
 	report_elements = []
 	report_elements.append(record.activity_key)
 	report_elements.append(record.doi)
-	report_elements.append(record.data["download"]["request"].get("type"))
+	report_elements.append(record.request_type)
 	report_elements.append(record.te_papa_records)
 	report_elements.append(record.total_records)
 	report_elements.append(record.contribution_percentage)
@@ -0,0 +1,94 @@
+import re
+from util.config import read_config
+
+default_location_predicates = ["CONTINENT", "COUNTRY", "STATE_PROVINCE", "LOCALITY"]
+default_excluded_taxa = [5, 6]
+default_max_records = 245000
+created_pattern = re.compile(r'"created"\s*:\s*"([^"]*)"')
+
+
+class RecordFilter():
+	# Everything the load loop needs from the config, resolved once per run rather than once per record
+	def __init__(self, start=None, end=None):
+		# start and end are created date prefixes such as "2024-03"; end is the first month not wanted
+		self.start = start
+		self.end = end
+		self.location_types = read_config("location_predicates") or default_location_predicates
+		self.other_fields = read_config("tracked_predicates") or []
+		self.search_keys = set(["TAXON_KEY"] + self.location_types + self.other_fields)
+		self.exclusions = []
+
+	def in_window(self, created):
+		# ISO date strings sort the same as the dates they hold, so the prefix is enough
+		if self.start and created < self.start:
+			return False
+		if self.end and created >= self.end:
+			return False
+		return True
+
+	def has_window(self):
+		return bool(self.start or self.end)
+
+	def line_in_window(self, line):
+		# A quick look at a raw JSON line, so records outside the window are never parsed. The request can hold
+		# its own "created" values, so a line is only dropped when every one found is outside the window;
+		# whatever is kept is checked again once parsed
+		found = False
+		for match in created_pattern.finditer(line):
+			if self.in_window(match.group(1)):
+				return True
+			found = True
+		return not found
+
+	def add_exclusion(self, name, check):
+		self.exclusions.append((name, check))
+
+	def excluded(self, record):
+		for name, check in self.exclusions:
+			if check(record):
+				return True
+		return False
+
+	def describe(self):
+		return {"location_predicates": self.location_types,
+		        "tracked_predicates": self.other_fields,
+		        "exclusions": [name for name, check in self.exclusions]}
+
+
+def compile_record_filter(start=None, end=None):
+	record_filter = RecordFilter(start, end)
+	record_filter.add_exclusion("whole_dataset", whole_dataset_download)
+
+	max_records = read_config("max_te_papa_records") or default_max_records
+	record_filter.add_exclusion("max_records:{}".format(max_records), larger_than(max_records))
+
+	excluded_taxa = read_config("excluded_taxa")
+	if excluded_taxa is None:
+		excluded_taxa = default_excluded_taxa
+	if excluded_taxa:
+		record_filter.add_exclusion("taxon_keys:{}".format(",".join(str(i) for i in excluded_taxa)),
+		                            uses_taxa(excluded_taxa))
+
+	return record_filter
+
+
+def whole_dataset_download(record):
+	return record.te_papa_records == record.total_records
+
+
+def larger_than(max_records):
+	def check(record):
+		return bool(record.te_papa_records) and record.te_papa_records > max_records
+	return check
+
+
+def uses_taxa(excluded_taxa):
+	# Predicate values are strings, so compare keys as strings whatever type the config gives
+	excluded_keys = frozenset(str(i) for i in excluded_taxa)
+
+	def check(record):
+		for taxon_key in record.taxon_keys:
+			if str(taxon_key) in excluded_keys:
+				return True
+		return False
+	return check
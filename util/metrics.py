@@ -0,0 +1,93 @@
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from util.codec import json_dump
+from util.config import read_config
+
+
+class RunMetrics():
+	def __init__(self):
+		self.started = None
+		self.stages = {}
+		self.counters = {}
+		self.lock = threading.Lock()
+
+	def count(self, name, amount=1):
+		with self.lock:
+			self.counters[name] = self.counters.get(name, 0) + amount
+
+	@contextmanager
+	def stage(self, name, records_counter=None):
+		# Times a stage and keeps how much each counter moved while it ran
+		if not self.started:
+			self.started = datetime.now().isoformat(timespec="seconds")
+		with self.lock:
+			counters_before = dict(self.counters)
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			wall_time = time.perf_counter() - start
+			with self.lock:
+				counter_changes = {k: v - counters_before.get(k, 0) for k, v in self.counters.items()
+				                   if v != counters_before.get(k, 0)}
+			stage_metrics = {"wall_seconds": round(wall_time, 3),
+			                 "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+			                 "counters": counter_changes}
+			if records_counter:
+				records = counter_changes.get(records_counter, 0)
+				stage_metrics["records"] = records
+				stage_metrics["records_per_second"] = round(records / wall_time, 1) if wall_time else None
+			self.stages[name] = stage_metrics
+
+	def summary(self):
+		lookups = self.counters.get("taxon_cache_hits", 0) + self.counters.get("taxon_cache_misses", 0)
+		return {"started": self.started,
+		        "finished": datetime.now().isoformat(timespec="seconds"),
+		        "wall_seconds": round(sum(stage["wall_seconds"] for stage in self.stages.values()), 3),
+		        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+		        "taxon_cache_hit_rate": round(self.counters.get("taxon_cache_hits", 0) / lookups, 3) if lookups else None,
+		        "stages": self.stages,
+		        "counters": self.counters}
+
+	def write_summary(self):
+		filepath = read_config("metrics_file") or "data/report_data/run_summary.json"
+		summary = self.summary()
+		with open(filepath, "w", encoding="utf-8") as f:
+			if read_config("metrics_format") == "prometheus":
+				f.write(format_prometheus(summary))
+			else:
+				json_dump(summary, f, indent=2)
+		print("Saved run summary to {}".format(os.path.abspath(filepath)))
+
+
+def format_prometheus(summary):
+	# Textfile collector format, for node_exporter to pick up
+	lines = ["# TYPE gbif_analytics_stage_seconds gauge"]
+	for stage, stage_metrics in summary["stages"].items():
+		lines.append('gbif_analytics_stage_seconds{{stage="{s}"}} {v}'.format(s=stage, v=stage_metrics["wall_seconds"]))
+	lines.append("# TYPE gbif_analytics_stage_records_per_second gauge")
+	for stage, stage_metrics in summary["stages"].items():
+		if stage_metrics.get("records_per_second") is not None:
+			lines.append('gbif_analytics_stage_records_per_second{{stage="{s}"}} {v}'.format(
+				s=stage, v=stage_metrics["records_per_second"]))
+	lines.append("# TYPE gbif_analytics_counter_total counter")
+	for name, value in summary["counters"].items():
+		lines.append('gbif_analytics_counter_total{{name="{n}"}} {v}'.format(n=name, v=value))
+	lines.append("# TYPE gbif_analytics_peak_rss_kilobytes gauge")
+	lines.append("gbif_analytics_peak_rss_kilobytes {}".format(summary["peak_rss_kb"]))
+	lines.append("# TYPE gbif_analytics_run_seconds gauge")
+	lines.append("gbif_analytics_run_seconds {}".format(summary["wall_seconds"]))
+	if summary["taxon_cache_hit_rate"] is not None:
+		lines.append("# TYPE gbif_analytics_taxon_cache_hit_ratio gauge")
+		lines.append("gbif_analytics_taxon_cache_hit_ratio {}".format(summary["taxon_cache_hit_rate"]))
+	lines.append("# TYPE gbif_analytics_last_run_timestamp_seconds gauge")
+	lines.append("gbif_analytics_last_run_timestamp_seconds {}".format(int(time.time())))
+
+	return "\n".join(lines) + "\n"
+
+
+metrics = RunMetrics()
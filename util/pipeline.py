@@ -0,0 +1,88 @@
+import os
+import heapq
+import asyncio
+from operator import itemgetter
+from data.download import download_activity, download_citations
+from data.datastore import taxon_data
+from util.config import read_config
+from util.filters import compile_record_filter
+from util.processing import (report_months, use_record_filter, summarise_month, file_fingerprint, process_activity_data,
+                             resolve_taxa, find_greatest_proportion)
+from util.export import export_proportion_report, export_report_data
+from util.metrics import metrics
+
+
+def run_pipeline(dataset_id, download_mode):
+	# The same stages as a normal run, but the slow ones overlap: citations and the report blocks that only
+	# need them are done while activity is paging, and each month is summarised and has its taxa looked up
+	# as soon as the download has moved past it. The later stages then mostly reuse that work
+	# Kept under the download stage name, so run summaries look the same in either mode
+	with metrics.stage("download", records_counter="activity_records_downloaded"):
+		asyncio.run(overlap_downloads(dataset_id, download_mode))
+	with metrics.stage("process", records_counter="records_loaded"):
+		process_activity_data(use_summaries=True)
+	with metrics.stage("rank"):
+		sorted_records = find_greatest_proportion()
+		resolve_taxa()
+	with metrics.stage("export"):
+		export_proportion_report(sorted_records)
+		export_report_data()
+
+
+async def overlap_downloads(dataset_id, download_mode):
+	loop = asyncio.get_running_loop()
+	finished_months = asyncio.Queue()
+
+	def month_complete(filepath):
+		# Called from the download thread
+		loop.call_soon_threadsafe(finished_months.put_nowait, filepath)
+
+	async def download():
+		try:
+			await asyncio.to_thread(download_activity, dataset_id, download_mode, month_complete)
+		finally:
+			month_complete(None)
+
+	await asyncio.gather(download(),
+	                     download_citations_and_blocks(dataset_id),
+	                     prepare_months(finished_months))
+
+
+async def download_citations_and_blocks(dataset_id):
+	await asyncio.to_thread(download_citations, dataset_id)
+	if read_config("report_render_cache") is not False:
+		from report import report
+		try:
+			await asyncio.to_thread(report.prerender_blocks)
+		except Exception as error:
+			# Only a head start for the report stage, which deals with missing inputs the usual way
+			print("Skipped rendering report blocks early: {}".format(error))
+
+
+async def prepare_months(finished_months):
+	# Months turn up newest first. Each one in the report is summarised for process_activity_data to reuse,
+	# and its taxa go into taxon_data so resolve_taxa has little left to fetch
+	start_month, end_month = report_months(read_config("report_mode"))
+	use_record_filter(compile_record_filter())
+	summarise = read_config("analytics_store") != "sqlite"
+	while True:
+		filepath = await finished_months.get()
+		if filepath is None:
+			return
+		month = os.path.basename(filepath)[:6]
+		if not summarise or (start_month and month < start_month) or (end_month and month > end_month):
+			continue
+		await asyncio.to_thread(prepare_month, filepath)
+
+
+def prepare_month(filepath):
+	summary = summarise_month(filepath, file_fingerprint(filepath))
+	taxon_data.resolve_taxon_details(summary_taxon_keys(summary))
+
+
+def summary_taxon_keys(summary):
+	# Only the month's own top taxa and top downloads, the ones most likely to make the report
+	month_taxon_keys = [taxon_key for taxon_key, count in heapq.nlargest(10, summary["taxa"], key=itemgetter(1))]
+	for record_summary in summary["top"]:
+		month_taxon_keys.extend(record_summary["taxon_keys"])
+	return month_taxon_keys
@@ -1,30 +1,124 @@
+import os
+import re
+import hashlib
 from datetime import datetime, date
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from operator import attrgetter, itemgetter
+import heapq
 from tqdm import tqdm
 from data.datastore import (activity_memo, activity_data, ActivityRecord, taxon_keys, taxon_memo, taxon_data, locations,
-                            location_memo)
-from data.io_interface import read_directory_files, read_json_file
-from util.config import read_config, write_config
-
-
-def process_activity_data():
-	if read_config("report_mode") != "full":
-		set_most_recent_month()
-	load_required_data(month=read_config("report_mode"))
+                            location_memo, tracked_predicates, predicate_memo, intern_value)
+from data.sqlstore import ActivityStore
+from data.month_index import select_month_files
+from data.io_interface import (list_activity_files, find_activity_file, enumerate_json_file, read_json_file,
+                               replace_json_file, file_stat_fingerprint)
+from util.config import read_config, write_config, set_config, copy_config
+from util.filters import compile_record_filter
+from util.metrics import metrics
+
+record_filter = None
+
+
+def process_activity_data(use_summaries=False):
+	start_month, end_month = report_months(read_config("report_mode"))
+	# Month summaries and the analytics store hold whole months, so only a single month load filters by date
+	use_record_filter(compile_record_filter())
+	if read_config("analytics_store") == "sqlite":
+		load_from_store(start_month, end_month)
+		return
+
+	if use_summaries or not start_month or start_month != end_month:
+		filepaths = select_month_files(start_month, end_month)
+		summaries = summarise_months(filepaths)
+		apply_summary(merge_summaries(summaries))
+		return
+
+	use_record_filter(compile_record_filter(*report_window(start_month, end_month)))
+	load_required_data(month=start_month)
 
 	count_taxa()
 	deduplicate_activity_taxa()
 	count_locations()
 	deduplicate_locations()
+	count_tracked_predicates()
 
 
 def load_required_data(month=None):
 	if month:
-		data = read_json_file("data/saved_data/{}-activity.json".format(month))
+		filepaths = [find_activity_file(month)]
 	else:
-		data = read_directory_files("data/saved_data", dontload="saved_metadata.json")
+		filepaths = list_activity_files("data/saved_data")
+
+	# With a report window, records from other months are dropped from the raw line before they are parsed
+	run_filter = get_record_filter()
+	keep_line = run_filter.line_in_window if run_filter.has_window() else None
+	for filepath in filepaths:
+		load_activity_records(enumerate_json_file(filepath, keep_line), filepath)
+
+
+def report_months(report_mode):
+	# Turns report_mode into the first and last months to report on, as YYYYMM strings
+	if isinstance(report_mode, int):
+		# YAML reads an unquoted YYYYMM as a number
+		report_mode = str(report_mode)
+	if not isinstance(report_mode, str):
+		raise ValueError("report_mode must be full, month, YYYYMM, YYYYMM-YYYYMM, YYYYQn or FYYYYY, not {!r}".format(
+			report_mode))
+
+	if report_mode == "full":
+		return None, None
+	if report_mode == "month":
+		set_most_recent_month()
+		month = read_config("most_recent_month").strftime("%Y%m")
+		return month, month
+
+	range_match = re.fullmatch(r"(\d{6})-(\d{6})", report_mode)
+	quarter_match = re.fullmatch(r"(\d{4})Q([1-4])", report_mode)
+	financial_year_match = re.fullmatch(r"FY(\d{4})", report_mode)
+	if range_match:
+		start_month, end_month = range_match.groups()
+	elif quarter_match:
+		year, quarter = quarter_match.groups()
+		first_month = (int(quarter) - 1) * 3 + 1
+		start_month = "{y}{m:02d}".format(y=year, m=first_month)
+		end_month = "{y}{m:02d}".format(y=year, m=first_month + 2)
+	elif financial_year_match:
+		# Financial years are named for the calendar year they end in
+		year = int(financial_year_match.group(1))
+		first_month = read_config("financial_year_start") or 7
+		if first_month not in range(1, 13):
+			raise ValueError("financial_year_start must be a month from 1 to 12, not {!r}".format(first_month))
+		if first_month == 1:
+			start_month, end_month = "{}01".format(year), "{}12".format(year)
+		else:
+			start_month = "{y}{m:02d}".format(y=year - 1, m=first_month)
+			end_month = "{y}{m:02d}".format(y=year, m=first_month - 1)
+	elif re.fullmatch(r"\d{6}", report_mode):
+		start_month, end_month = report_mode, report_mode
+	else:
+		raise ValueError("Can't read report_mode {!r}; use full, month, YYYYMM, YYYYMM-YYYYMM, YYYYQn or FYYYYY".format(
+			report_mode))
+
+	for month in (start_month, end_month):
+		if not 1 <= int(month[4:6]) <= 12:
+			raise ValueError("report_mode {m!r} has an invalid month {v}".format(m=report_mode, v=month))
+	if start_month > end_month:
+		raise ValueError("report_mode {!r} covers no months, as it ends before it starts".format(report_mode))
 
-	load_activity_records(data)
+	return start_month, end_month
+
+
+def use_record_filter(new_filter):
+	global record_filter
+	record_filter = new_filter
+
+
+def get_record_filter():
+	# Worker processes build their own on first use, from the config they were started with
+	if not record_filter:
+		use_record_filter(compile_record_filter())
+	return record_filter
 
 
 def set_most_recent_month():
@@ -34,115 +128,102 @@ def set_most_recent_month():
 	write_config("most_recent_month", most_recent_month)
 
 
-def load_activity_records(records):
-	for record in tqdm(records, desc="Loading records"):
-		store_activity_record(record)
-
-
-def store_activity_record(record):
-	activity_key = record["downloadKey"]
-	activity_memo[activity_key] = {"taxon_keys": [], "locations": []}
-	activity_record = ActivityRecord(activity_key, record)
-	post_process(activity_record)
+def load_activity_records(positioned_records, source=None):
+	# Takes (position, record) pairs, so positions still point at the source file when records are skipped
+	loaded = 0
+	run_filter = get_record_filter()
+	for position, record in tqdm(positioned_records, desc="Loading records"):
+		if store_activity_record(record, source, position, run_filter):
+			loaded += 1
+	metrics.count("records_loaded", loaded)
+
+
+def store_activity_record(record, source=None, position=None, run_filter=None):
+	# Records outside the report window are turned away before anything is built for them
+	run_filter = run_filter or get_record_filter()
+	created = record["download"]["created"]
+	if not run_filter.in_window(created):
+		return False
+
+	# Only the fields the report uses are kept; the raw JSON can be reread from source if needed
+	activity_record = ActivityRecord(record["downloadKey"], source, position)
+	activity_record.created = created
+	post_process(activity_record, record, run_filter)
+	activity_memo[activity_record.activity_key] = activity_record
 	activity_data.data.append(activity_record)
+	return True
 
 
-def post_process(record):
-	if read_config("report_mode") == "month":
-		check_for_include_in_report(record)
-	if record.include_in_report:
-		check_for_taxon_details(record)
-		check_for_locations(record)
-		record.activity_key = record.data["downloadKey"]
-		record.doi = record.data["download"].get("doi")
-		record.total_records = record.data["download"]["totalRecords"]
-		record.te_papa_records = record.data["numberRecords"]
-		record.link = "https://www.gbif.org/occurrence/download/{}".format(record.data["downloadKey"])
-		check_for_sort_exclusion(record)
-
-
-def check_for_include_in_report(record):
-	most_recent_month = read_config("most_recent_month")
-	rec_date = record.data["download"]["created"].split("+")[0]
-	rec_datestamp = datetime.fromisoformat(rec_date)
-	if rec_datestamp.year == most_recent_month.year and rec_datestamp.month == most_recent_month.month:
-		print("Record safe!")
-		pass
-	else:
-		print(rec_datestamp.year, most_recent_month.year)
-		print(rec_datestamp.month, most_recent_month.month)
+def post_process(record, raw_record, run_filter):
+	check_predicates(record, raw_record, run_filter)
+	fill_record_details(record, raw_record)
+	if run_filter.excluded(record):
 		record.include_in_report = False
+	record.contribution_percentage = calculate_contribution(record)
 
 
-def check_for_taxon_details(record):
-	try:
-		request_predicate = record.data["download"]["request"].get("predicate")
-		if request_predicate:
-			record_taxon_keys = gather_keys(request_predicate)
-			for taxon_key in record_taxon_keys:
-				record_taxon_key_use(taxon_key, record.activity_key)
-	except KeyError:
-		pass
+def fill_record_details(record, raw_record):
+	record.doi = raw_record["download"].get("doi")
+	record.request_type = intern_value(raw_record["download"]["request"].get("type"))
+	record.total_records = raw_record["download"]["totalRecords"]
+	record.te_papa_records = raw_record["numberRecords"]
 
 
-def gather_keys(request_predicate):
-	record_taxon_keys = navigate_predicates(request_predicate, "TAXON_KEY")
-	return record_taxon_keys
+def check_predicates(record, raw_record, run_filter):
+	predicate_values = get_predicate_values(raw_record, run_filter.search_keys)
 
+	for taxon_key in predicate_values.get("TAXON_KEY", []):
+		record_taxon_key_use(intern_value(taxon_key), record)
+	for location_type in run_filter.location_types:
+		for pred_loc in predicate_values.get(location_type, []):
+			record_location_use(intern_value(pred_loc), location_type, record)
+	for field in run_filter.other_fields:
+		if predicate_values.get(field):
+			tracked_predicates.setdefault(field, []).extend(intern_value(i) for i in predicate_values[field])
 
-def record_taxon_key_use(taxon_key, activity_key):
-	taxon_keys.append(taxon_key)
 
-	activity_memo[activity_key]["taxon_keys"].append(taxon_key)
-
-
-def check_for_locations(record):
+def get_predicate_values(raw_record, search_keys):
 	try:
-		request_predicate = record.data["download"]["request"].get("predicate")
-		if request_predicate:
-			loc_types = ["CONTINENT", "COUNTRY", "STATE_PROVINCE", "LOCALITY"]
-			for location_type in loc_types:
-				predicate_locations = navigate_predicates(request_predicate, location_type)
-				for pred_loc in predicate_locations:
-					if not locations.get(location_type):
-						locations[location_type] = []
-					locations[location_type].append(pred_loc)
-					activity_memo[record.activity_key]["locations"].append(pred_loc)
-
+		request_predicate = raw_record["download"]["request"].get("predicate")
 	except KeyError:
-		pass
+		return {}
+	if not request_predicate:
+		return {}
+
+	return walk_predicates(request_predicate, search_keys)
+
+
+def walk_predicates(predicate_data, search_keys):
+	# One pass over the predicate tree, collecting values for every field we track
+	values = {}
+	stack = [predicate_data]
+	while stack:
+		predicate = stack.pop()
+		sub_predicates = predicate.get("predicates")
+		if sub_predicates:
+			stack.extend(reversed(sub_predicates))
+		search_key = predicate.get("key")
+		if search_key in search_keys:
+			if predicate.get("type") == "equals":
+				values.setdefault(search_key, []).append(predicate.get("value"))
+			elif predicate.get("type") == "in":
+				values.setdefault(search_key, []).extend(predicate.get("values"))
 
+	return values
 
-def navigate_predicates(predicate_data, search_key):
-	values = []
-	for key, value in predicate_data.items():
-		if key == "predicates":
-			for predicate in value:
-				values.extend(navigate_predicates(predicate, search_key))
-		elif value == search_key:
-			if predicate_data.get("type") == "equals":
-				values.append(predicate_data.get("value"))
-			elif predicate_data.get("type") == "in":
-				values.extend(predicate_data.get("values"))
 
-	return values
+def record_taxon_key_use(taxon_key, record):
+	taxon_keys.append(taxon_key)
 
+	record.taxon_keys.append(taxon_key)
 
-def check_for_sort_exclusion(record):
-	excluded = False
-	if record.te_papa_records == record.total_records:
-		excluded = True
-	if record.te_papa_records:
-		if int(record.te_papa_records) > 245000:
-			excluded = True
-	excluded_taxa = [5, 6]
-	rec_taxon_keys = activity_memo[record.activity_key]["taxon_keys"]
-	for taxon in excluded_taxa:
-		if taxon in rec_taxon_keys:
-			excluded = True
-
-	if excluded:
-		record.include_in_report = False
+
+def record_location_use(location, location_type, record):
+	if not locations.get(location_type):
+		locations[location_type] = []
+	locations[location_type].append(location)
+
+	record.locations.append(location)
 
 
 def count_taxa():
@@ -152,10 +233,9 @@ def count_taxa():
 
 
 def deduplicate_activity_taxa():
-	for key in activity_memo.keys():
-		activity_taxon_keys = activity_memo[key]["taxon_keys"]
-		if len(activity_taxon_keys) > 0:
-			activity_memo[key]["taxon_keys"] = list(set(activity_taxon_keys))
+	for activity_record in activity_memo.values():
+		if len(activity_record.taxon_keys) > 0:
+			activity_record.taxon_keys = list(set(activity_record.taxon_keys))
 
 
 def count_locations():
@@ -165,11 +245,15 @@ def count_locations():
 			location_memo[k] = {"location_type": loc_type, "count": v}
 
 
+def count_tracked_predicates():
+	for field, values in tracked_predicates.items():
+		predicate_memo[field] = dict(Counter(values))
+
+
 def deduplicate_locations():
-	for key in activity_memo.keys():
-		activity_locations = activity_memo[key]["locations"]
-		if len(activity_locations) > 0:
-			activity_memo[key]["locations"] = list(set(activity_locations))
+	for activity_record in activity_memo.values():
+		if len(activity_record.locations) > 0:
+			activity_record.locations = list(set(activity_record.locations))
 
 
 def find_greatest_proportion():
@@ -178,32 +262,256 @@ def find_greatest_proportion():
 
 
 def sort_by_contribution():
-	for activity_record in activity_data.data:
-		if activity_record.total_records and activity_record.te_papa_records:
-			if activity_record.total_records < activity_record.te_papa_records:
-				# TODO: Log these oddities
-				activity_record.contribution_percentage = 0
-			else:
-				cont_perc = round((int(activity_record.te_papa_records) / int(activity_record.total_records)) * 100, 2)
-				activity_record.contribution_percentage = cont_perc
-		else:
-			activity_record.contribution_percentage = 0
-
 	sorted_records = sort_activity_records(10)
 	return sorted_records
 
 
+def calculate_contribution(record):
+	if record.total_records and record.te_papa_records:
+		if record.total_records < record.te_papa_records:
+			# TODO: Log these oddities
+			return 0
+		return round((record.te_papa_records / record.total_records) * 100, 2)
+	return 0
+
+
 def sort_activity_records(count):
-	sorted_records = sorted([i for i in activity_data.data if i.include_in_report],
-	                        key=lambda activity_record: activity_record.contribution_percentage,
-	                        reverse=True)
+	ranking = activity_data.rankings.get(count)
+	if not ranking or ranking[0] != len(activity_data.data):
+		top_records = heapq.nlargest(count,
+		                             (i for i in activity_data.data if i.include_in_report),
+		                             key=attrgetter("contribution_percentage"))
+		ranking = (len(activity_data.data), top_records)
+		activity_data.rankings[count] = ranking
+
+	return list(ranking[1])
+
+
+def summarise_months(filepaths):
+	# Each month's aggregates are saved alongside it and only rebuilt when the month's file changes
+	summaries = {}
+	stale_months = []
+	for filepath in filepaths:
+		fingerprint = file_fingerprint(filepath)
+		saved_summary = load_saved_summary(filepath, fingerprint)
+		if saved_summary:
+			metrics.count("summaries_reused")
+			summaries[filepath] = saved_summary
+		else:
+			stale_months.append((filepath, fingerprint))
+
+	# Loading a month is CPU bound, so rebuild stale months in separate processes when workers are set
+	workers = read_config("process_workers") or 1
+	if workers > 1 and len(stale_months) > 1:
+		with ProcessPoolExecutor(max_workers=workers, initializer=set_config, initargs=(copy_config(),)) as executor:
+			month_summaries = executor.map(summarise_month, *zip(*stale_months))
+			for summary in tqdm(month_summaries, total=len(stale_months), desc="Summarising months"):
+				metrics.count("records_loaded", summary["record_count"])
+				summaries[summary["source"]] = summary
+	else:
+		for filepath, fingerprint in tqdm(stale_months, desc="Summarising months"):
+			summaries[filepath] = summarise_month(filepath, fingerprint)
+
+	return [summaries[filepath] for filepath in filepaths]
+
+
+def load_saved_summary(filepath, fingerprint):
+	summary_path = summary_filepath(filepath)
+	if os.path.exists(summary_path):
+		# A summary that can't be parsed comes back as None and is simply rebuilt
+		saved_summary = read_json_file(summary_path)
+		if isinstance(saved_summary, dict) and saved_summary.get("fingerprint") == fingerprint:
+			return saved_summary
+	return None
+
+
+def summarise_month(filepath, fingerprint):
+	summary_path = summary_filepath(filepath)
+	clear_loaded_data()
+	load_activity_records(enumerate_json_file(filepath), filepath)
+	summary = build_summary(filepath, fingerprint)
+	clear_loaded_data()
 
-	if len(sorted_records) < count:
-		range_int = len(sorted_records)
+	# Replaced in one step, so an interrupted run never leaves a cut-off summary that still looks current
+	os.makedirs(os.path.dirname(summary_path), exist_ok=True)
+	replace_json_file(summary_path, summary)
+
+	return summary
+
+
+def summary_filepath(filepath):
+	month = os.path.basename(filepath).split("-")[0]
+	return "data/saved_data/summaries/{}-summary.json".format(month)
+
+
+def file_fingerprint(filepath):
+	file_stats = file_stat_fingerprint(filepath)
+	fingerprint = {"size": file_stats["size"],
+	               "top_k": read_config("summary_top_k") or 10}
+	fingerprint.update(get_record_filter().describe())
+	if read_config("summary_check") == "hash":
+		file_hash = hashlib.sha256()
+		with open(filepath, "rb") as f:
+			for chunk in iter(lambda: f.read(1 << 20), b""):
+				file_hash.update(chunk)
+		fingerprint["sha256"] = file_hash.hexdigest()
 	else:
-		range_int = count
+		fingerprint["mtime"] = file_stats["mtime"]
+
+	return fingerprint
+
+
+def clear_loaded_data():
+	activity_memo.clear()
+	activity_data.data.clear()
+	activity_data.rankings.clear()
+	taxon_keys.clear()
+	locations.clear()
+	tracked_predicates.clear()
+
+
+def build_summary(filepath, fingerprint):
+	top_k = read_config("summary_top_k") or 10
+	return {"source": filepath,
+	        "fingerprint": fingerprint,
+	        "record_count": len(activity_data.data),
+	        "taxa": list(Counter(taxon_keys).items()),
+	        "locations": {loc_type: list(Counter(values).items()) for loc_type, values in locations.items()},
+	        "predicates": {field: list(Counter(values).items()) for field, values in tracked_predicates.items()},
+	        "top": [summarise_record(record) for record in sort_activity_records(top_k)]}
+
+
+def summarise_record(record):
+	return {"activity_key": record.activity_key,
+	        "source": record.source,
+	        "position": record.position,
+	        "created": record.created,
+	        "doi": record.doi,
+	        "request_type": record.request_type,
+	        "total_records": record.total_records,
+	        "te_papa_records": record.te_papa_records,
+	        "contribution_percentage": record.contribution_percentage,
+	        "taxon_keys": list(set(record.taxon_keys)),
+	        "locations": list(set(record.locations))}
+
+
+def restore_record(record_summary):
+	record = ActivityRecord(record_summary["activity_key"], record_summary["source"], record_summary["position"])
+	for field in ["created", "doi", "request_type", "total_records", "te_papa_records", "contribution_percentage",
+	              "taxon_keys", "locations"]:
+		setattr(record, field, record_summary[field])
+	return record
+
+
+def merge_summaries(summaries):
+	merged = {"record_count": 0,
+	          "taxa": Counter(),
+	          "locations": {},
+	          "predicates": {},
+	          "top": []}
+	for summary in summaries:
+		merged["record_count"] += summary["record_count"]
+		merged["taxa"].update(dict(summary["taxa"]))
+		for loc_type, location_counts in summary["locations"].items():
+			merged["locations"].setdefault(loc_type, Counter()).update(dict(location_counts))
+		for field, value_counts in summary["predicates"].items():
+			merged["predicates"].setdefault(field, Counter()).update(dict(value_counts))
+		merged["top"].extend(summary["top"])
+
+	# Every month keeps its own top k, so the overall top k must be among them
+	merged["top"] = heapq.nlargest(read_config("summary_top_k") or 10,
+	                               merged["top"],
+	                               key=itemgetter("contribution_percentage"))
+
+	return merged
+
+
+def apply_summary(summary):
+	# The counts are replaced outright, so taxa or locations from months no longer reported don't linger
+	clear_loaded_data()
+	taxon_memo.clear()
+	location_memo.clear()
+	predicate_memo.clear()
+	for k, v in summary["taxa"].items():
+		taxon_memo[k] = {"name": None, "count": v}
+	for loc_type, location_counts in summary["locations"].items():
+		for k, v in location_counts.items():
+			location_memo[k] = {"location_type": loc_type, "count": v}
+	for field, value_counts in summary["predicates"].items():
+		predicate_memo[field] = dict(value_counts)
+	for record_summary in summary["top"]:
+		activity_record = restore_record(record_summary)
+		activity_memo[activity_record.activity_key] = activity_record
+		activity_data.data.append(activity_record)
+	activity_data.full_count = summary["record_count"]
+
+
+def load_from_store(start_month, end_month):
+	# Month files are ingested into SQLite once each, then every aggregate is a query over the report's dates
+	store = ActivityStore()
+	store.remove_missing_sources(list_activity_files("data/saved_data"))
+	run_filter = get_record_filter()
+	for filepath in tqdm(select_month_files(start_month, end_month), desc="Updating analytics store"):
+		fingerprint = file_fingerprint(filepath)
+		if not store.is_current(filepath, fingerprint):
+			rows = (build_store_rows(raw_record, filepath, position, run_filter)
+			        for position, raw_record in enumerate_json_file(filepath))
+			store.replace_source(filepath, fingerprint, rows)
+
+	start, end = report_window(start_month, end_month)
+	apply_summary(store.summarise(read_config("summary_top_k") or 10, start, end))
+	store.close()
+
+
+def report_window(start_month, end_month):
+	# Date string bounds for created, from the start of the first month up to the start of the month after the last
+	start = None
+	end = None
+	if start_month:
+		start = "{y}-{m}".format(y=start_month[:4], m=start_month[4:6])
+	if end_month:
+		year, month = int(end_month[:4]), int(end_month[4:6])
+		next_year, next_month = (year, month + 1) if month != 12 else (year + 1, 1)
+		end = "{y}-{m:02d}".format(y=next_year, m=next_month)
+	return start, end
+
+
+def build_store_rows(raw_record, source, position, run_filter):
+	location_types = run_filter.location_types
+	other_fields = run_filter.other_fields
+	predicate_values = get_predicate_values(raw_record, run_filter.search_keys)
+
+	record = ActivityRecord(raw_record["downloadKey"], source, position)
+	record.created = raw_record["download"]["created"]
+	record.taxon_keys = predicate_values.get("TAXON_KEY", [])
+	fill_record_details(record, raw_record)
+	if run_filter.excluded(record):
+		record.include_in_report = False
+	record.contribution_percentage = calculate_contribution(record)
+	metrics.count("records_loaded")
+
+	key = record.activity_key
+	download = (key, source, position, record.created, record.doi, record.request_type, record.total_records,
+	            record.te_papa_records, record.contribution_percentage, int(record.include_in_report))
+	taxa = [(key, taxon_key) for taxon_key in record.taxon_keys]
+	download_locations = [(key, location_type, value) for location_type in location_types
+	                      for value in predicate_values.get(location_type, [])]
+	predicates = [(key, field, value) for field in other_fields for value in predicate_values.get(field, [])]
+	return download, taxa, download_locations, predicates
+
+
+def resolve_taxa():
+	# Fetch every taxon the report will mention up front, so exporting needs no lookups. That's only the
+	# top taxa and the taxa of the top downloads, not every taxon that was downloaded
+	report_taxon_keys = [taxon_key for taxon_key, count in top_taxa(10)]
+	for activity_record in sort_activity_records(10):
+		report_taxon_keys.extend(activity_record.taxon_keys)
+	taxon_data.resolve_taxon_details(report_taxon_keys)
+
 
-	return sorted_records[:range_int]
+def top_taxa(count):
+	# Most used taxa first, as (taxon_key, count) pairs
+	return heapq.nlargest(count, ((k, v["count"]) for k, v in taxon_memo.items()), key=itemgetter(1))
 
 
 def get_taxon_record_values(taxon_keys, field_name):
@@ -211,6 +519,8 @@ def get_taxon_record_values(taxon_keys, field_name):
 	taxon_values = []
 	for taxon_key in taxon_keys:
 		taxon_record = taxon_data.data[taxon_key]
+		if not taxon_record.data:
+			continue
 		lookup_value = taxon_record.data.get(field_name)
 		if lookup_value:
 			taxon_values.append(lookup_value)